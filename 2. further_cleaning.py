@@ -3,16 +3,63 @@
 
 import os
 import re
-import pickle
+import time
+import multiprocessing
+import numpy as np
 import pandas as pd
 from datetime import datetime
 from bs4 import BeautifulSoup
 import html
+# The cache and the helpers that clean each distinct text once are shared with the other scripts and notebooks.
+from pipeline_cache import (get_cache_path, save_to_cache, load_from_cache, get_cache_columns, text_hash,
+                            cleaner_version, cached_clean, factorize_column, broadcast_unique, report_dedup,
+                            apply_unique)
+# The further cleaned text is segmented once with the same function as cleaned_text, and the offsets of its sentences
+# are stored next to it so the later stages do not split it on '.' again.
+from sentence_segmentation import sentence_offsets, sentence_offset_column
 
+# re2 runs in linear time, it is only used for the articles that go over the time budget if it is installed.
+try:
+    import re2
+except ImportError:
+    re2 = None
 
-cache_dir = "cache"
-input_file = os.path.join(cache_dir, "trafilatura_quality_data.pkl")
-output_file = os.path.join(cache_dir, "best_quality_data.pkl")
+
+input_file = "trafilatura_quality_data.pkl"
+output_file = "best_quality_data.arrow"
+
+# Set to True to check the staged cleaners against the original ones on a sample of the input before cleaning.
+run_cleaning_benchmark = False
+benchmark_sample_size = 2000
+
+# Set to True to time every cleaning rule on a sample of the input and print the slowest rules before cleaning.
+run_rule_profile = False
+profile_sample_size = 2000
+# A rule that takes longer than this on a single article is flagged in the profile.
+rule_time_budget_ms = 50
+
+# Time one article may spend in the cleaning rules, None turns the budget off. With a budget the rules run in a worker
+# process that is stopped when the budget runs out. The article is then cleaned again with re2 or without the rule that
+# ran out of time, and is added to quarantined_articles.
+article_time_budget_ms = None
+
+# Set to False to clean every article again instead of reusing the results cached for the same text and rules.
+# Where the cache is kept and how many versions are kept is set in pipeline_cache.
+use_cleaning_cache = True
+
+# Set to False to clean every row even when the same text or title appears in several rows.
+dedup_cleaning = True
+
+# Set to False to keep every copy of syndicated and re-published stories. Articles whose word shingles are estimated to
+# overlap by at least near_duplicate_threshold (Jaccard) are clustered and only one article per cluster is kept, with
+# the number of articles it stands for in cluster_size. Every row's representative is saved to near_duplicates_file.
+remove_near_duplicates = True
+near_duplicate_threshold = 0.8
+shingle_words = 5
+minhash_permutations = 128
+lsh_bands = 16
+minhash_chunk_size = 2000
+near_duplicates_file = "near_duplicates.arrow"
 
 # I removed navigation elements, dates and additional content to more closely match the Trafilatura quality.
 def further_clean_text(text):
@@ -256,6 +303,847 @@ def enhanced_clean_text(text):
     
     return text
 
+# Staged cleaning engine.
+# The two cleaners above make one re.sub call per rule, so every article is scanned around a hundred times,
+# mostly by case-insensitive word alternations that Python's regex engine can only try one position at a time.
+# I moved the same rules into tables that are compiled once at import and run them on a lowercased copy of the text
+# with case-sensitive patterns, which the regex engine scans several times faster. The lowercased copy has the same
+# length as the text, so each match is cut out of both at the same positions.
+# Consecutive rules of a stage are also merged into one alternation that acts as a gate: a stage with no match costs a
+# single scan. Merging the substitutions themselves would change the output when matches overlap, so the rules of a
+# stage that does match still run one by one in the original order and the output stays byte-identical.
+FURTHER_CLEAN_RULES = [
+    # Navigation patterns and news site section markers.
+    ('navigation', r'(?i)(Home|Menu|Navigation|Search|Login|Sign up|Subscribe|Follow us)\s*[|\-•]', ''),
+    ('navigation', r'(?i)(News|Sports|Technology|Business|Entertainment|Politics|Opinion|Weather|AIXov XwmSpace|technology|Satellite|Science|US|Tiv tauj|Xov Xwm)\s*[|\-•]', ''),
+
+    # Dates in various formats.
+    ('dates', r'(?i)(January|February|March|April|May|June|July|August|September|October|November|December)\s+\d{1,2},\s+\d{4}', ''),
+    ('dates', r'(?i)(Jan|Feb|Mar|Apr|May|Jun|Jul|Aug|Sep|Sept|Oct|Nov|Dec)\s+\d{1,2},?\s+\d{4}', ''),
+    ('dates', r'(?i)(Mon|Tue|Wed|Thu|Fri|Sat|Sun)[a-z]*\.?\s+\d{1,2},?\s+\d{4}', ''),
+    ('dates', r'\d{1,2}/\d{1,2}/\d{2,4}', ''),
+
+    # Bylines, publishing info and time specifications.
+    ('bylines', r'(?i)By\s+[A-Za-z\s\.]+\s*[,|\-]\s*[A-Za-z\s\.]+', ''),
+    ('bylines', r'(?i)By\s+[A-Za-z\s\.]+\s*$', ''),
+    ('bylines', r'(?i)Published\s+\d{1,2}[a-z]{0,2}\s+[A-Za-z]+\s+\d{4}', ''),
+    ('bylines', r'(?i)\d{1,2}:\d{2}\s*[ap]\.?m\.?(\s+[A-Za-z]+)?', ''),
+
+    # Non-english text, social media buttons and copyright notices.
+    ('boilerplate', r'(?i)Hla mus rau cov ntsiab lus', ''),
+    ('boilerplate', r'(?i)Lub neej hauv nroog', ''),
+    ('boilerplate', r'(?i)(Share|Tweet|Email|Print|Facebook|Twitter|LinkedIn|Pinterest|Instagram|WhatsApp)\s*[|\-•]', ''),
+    ('boilerplate', r'(?i)©\s*\d{4}.*?(rights reserved|all rights)', ''),
+    ('boilerplate', r'(?i)Copyright\s*©?\s*\d{4}.*?$', ''),
+
+    # Comment section indicators.
+    ('comments', r'(?i)(Comments|Leave a comment|Add a comment|Join the conversation)', ''),
+
+    # Excessive new lines and spaces.
+    ('whitespace', r'\n{3,}', '\n\n'),
+    ('whitespace', r' {2,}', ' '),
+]
+
+ENHANCED_CLEAN_RULES = [
+    # Navigation elements.
+    ('navigation', r'(?i)(Home|Menu|Navigate|Search|Top|Back to top|Skip to( main)? content|Sign in|Log in|Register|Subscribe|Follow)(\s+[|•>\-→]|\s*$)', ''),
+    ('navigation', r'(?i)(Main Menu|Navigation Menu|Site Navigation|Primary Menu|Secondary Menu)', ''),
+    ('layout_words', r'(?i)(Header|Footer|Sidebar|Widget|Column|Panel|Section|Module|Block)', ''),
+    ('breadcrumbs', r'(?i)breadcrumb[s]?', ''),
+
+    # Previous or next article navigation.
+    ('previous', r'(?i)Previous\s*[:\-]?\s*[^.\n]+', ''),
+    ('next', r'(?i)Next\s*[:\-]?\s*[^.\n]+', ''),
+    ('article_navigation', r'(?i)(Previous|Earlier|Next|Later)\s+(Article|Post|Story|Read|Page)', ''),
+    ('article_navigation', r'(?i)(Read|See)\s+(Previous|Next|More|Related|Also)', ''),
+
+    # Section headers appearing in most websites.
+    ('section_headers', r'(?i)(News|Sports|Technology|Business|Entertainment|Politics|Opinion|Weather|' +
+                        r'World|Local|Regional|National|International|Breaking|Latest|Top Stories|' +
+                        r'Trending|Features|Analysis|Commentary|Videos|Photos|Premium|Special|Exclusive)', ''),
+
+    # Network and portal sections.
+    ('network', r'(?i)Our\s+Network\s+Portals?.*?(?=\n\n|\Z)', ''),
+    ('network', r'(?i)(Related|Sister|Partner)\s+(Sites?|Portals?|Networks?|Channels?|Publications?)', ''),
+    ('network', r'(?i)(More|Other)\s+(From|By|On|At)\s+[A-Za-z\s]+', ''),
+
+    # Common footer elements.
+    ('footer_words', r'(?i)(Contact Us|About Us|Our Team|Careers|Jobs|Sitemap|FAQ|Help|Support)', ''),
+    ('footer', r'(?i)(Terms of Service|Privacy Policy|Cookie Policy|User Agreement)', ''),
+    ('footer', r'(?i)(Follow Us|Connect with Us|Find Us|Join Us) on Social Media', ''),
+    ('footer', r'(?i)(All|Get)\s+the\s+(latest|best|top|breaking)\s+(news|stories|content|updates)', ''),
+    ('footer', r'(?i)Stay\s+(tuned|updated|informed|connected)', ''),
+    ('footer', r'(?i)Thanks\s+for\s+(reading|visiting|subscribing)', ''),
+
+    # Date formats.
+    ('date_labels', r'(?i)(Posted|Published|Updated|Modified|Date):?\s*', ''),
+    ('dates', r'(?i)\d{1,2}\s+(January|February|March|April|May|June|July|August|September|October|November|December)\s+\d{4}', ''),
+    ('dates', r'(?i)(January|February|March|April|May|June|July|August|September|October|November|December)\s+\d{1,2}(st|nd|rd|th)?,\s+\d{4}', ''),
+    ('dates', r'(?i)(Jan|Feb|Mar|Apr|May|Jun|Jul|Aug|Sep|Sept|Oct|Nov|Dec)\.?\s+\d{1,2}(st|nd|rd|th)?,?\s+\d{4}', ''),
+    ('dates', r'(?i)(Monday|Tuesday|Wednesday|Thursday|Friday|Saturday|Sunday|Mon|Tue|Wed|Thu|Fri|Sat|Sun),?\s+\d{1,2}\s+\w+\s+\d{4}', ''),
+    ('dates', r'\d{1,2}/\d{1,2}/\d{2,4}', ''),
+    ('dates', r'\d{4}-\d{2}-\d{2}', ''),
+
+    # Time formats.
+    ('dates', r'\d{1,2}:\d{2}(:\d{2})?\s*(am|pm|AM|PM|a\.m\.|p\.m\.)', ''),
+    ('time_zones', r'(?i)(EDT|EST|CDT|CST|MDT|MST|PDT|PST|UTC|GMT)(\s+|$)', ''),
+
+    # Author info and bylines.
+    ('bylines', r'(?i)By\s+[A-Za-z\s\.\-]+\s*[,|\-]\s*[A-Za-z\s\.\-]+', ''),
+    ('bylines', r'(?i)By\s+[A-Za-z\s\.\-]+\s*(Staff|Reporter|Editor|Writer|Correspondent|Contributor)', ''),
+    ('authors', r'(?i)(Written|Reported)\s+by\s+[A-Za-z\s\.\-]+', ''),
+    ('authors', r'(?i)Author[:]?\s+[A-Za-z\s\.\-]+', ''),
+    ('authors', r'(?i)(Staff|Special)\s+(Writer|Reporter|Correspondent)', ''),
+
+    # Social media.
+    ('social', r'(?i)(Share|Tweet|Post|Email|Print|Copy|Save|Bookmark|Favorite|Like|Follow|Subscribe|Connect)(\s+on|\s+to|\s+via|\s+with)?\s+' +
+               r'(Facebook|Twitter|Instagram|LinkedIn|Pinterest|Reddit|Tumblr|WhatsApp|Telegram|YouTube|TikTok|Snapchat|Email|Print)', ''),
+    ('social', r'(?i)(Follow|Like|Subscribe to) us on', ''),
+    ('social', r'(?i)(Follow|Connect with) us', ''),
+    ('social', r'(?i)Share this (article|post|story)', ''),
+    ('social', r'(?i)Share on social (media|networks)', ''),
+
+    # Social media follow sections.
+    ('social', r'(?i)(Follow|Connect|Find|Join)\s+(Us|with\s+Us|Me)\s+(on|at)\s+(Social\s+Media|Facebook|Twitter|Instagram|LinkedIn)', ''),
+    ('social', r'(?i)Please\s+follow\s+us\s+on\s+Social\s+Media', ''),
+    ('social', r'(?i)Follow\s+(on|us\s+on)\s+(Facebook|Twitter|Instagram|LinkedIn|YouTube|TikTok|Pinterest)', ''),
+
+    # Comment sections.
+    ('comment_words', r'(?i)(Comments|Leave a comment|Add a comment|Join the conversation|Discussion|Reply|Replies)', ''),
+    ('comments', r'(?i)\d+ comments?', ''),
+    ('comments', r'(?i)(Most popular|Top|Best) comments', ''),
+
+    # Cookies notices and privacy popups.
+    ('cookies', r'(?i)(Cookie|Privacy|Consent|GDPR|Data protection)(\s+Notice|\s+Policy|\s+Preferences|\s+Settings)', ''),
+    ('cookies', r'(?i)We use cookies', ''),
+    ('cookies', r'(?i)This (website|site) uses cookies', ''),
+    ('cookies', r'(?i)By (continuing|browsing|using) (this|our) (site|website)', ''),
+    ('accept', r'(?i)Accept( all| cookies| terms| conditions)?', ''),
+
+    # Copyright.
+    ('copyright', r'(?i)©\s*\d{4}.*?(rights reserved|all rights)', ''),
+    ('copyright', r'(?i)Copyright\s*©?\s*\d{4}.*?$', ''),
+    ('copyright', r'(?i)All rights reserved', ''),
+    ('copyright', r'(?i)Terms (of|and) (Use|Service|Privacy)', ''),
+
+    # Ads text.
+    ('ad_words', r'(?i)(Advertisement|Sponsored|Promotion|Ad|Ads|Advert)', ''),
+    ('ads', r'(?i)(Special|Promoted|Featured|Sponsored) Content', ''),
+    ('ads', r'(?i)From our sponsors?', ''),
+    ('ads', r'(?i)Recommended for you', ''),
+
+    # UI related elements.
+    ('ui', r'(?i)(Click|Tap) (here|to|on)', ''),
+    ('ui', r'(?i)(Read|See|View|Learn) (more|all|full|article)', ''),
+    ('ui_words', r'(?i)(Next|Previous|Continue reading|More stories)', ''),
+    ('ui', r'(?i)(Load|Show) more', ''),
+    ('ui', r'(?i)(Sign up|Subscribe) (now|today|for|to our)', ''),
+
+    # Analytics and tracking.
+    ('tracking_words', r'(?i)(Tracking ID|Analytics|Pixel|Tag|UA-\d+-\d+)', ''),
+    ('tracking', r'(?i)(Google Analytics|Google Tag Manager|Facebook Pixel)', ''),
+
+    # Contact info.
+    ('contact', r'(?i)Contact\s+(Us|Information|Details).*?(?=\n\n|\Z)', ''),
+    ('contact', r'(?i)(Email|Phone|WhatsApp|Telephone|Mobile|Fax)(\s+Us)?(\s+at)?:?.*?(?=\n|\Z)', ''),
+    ('contact', r'(?i)(Our|Company|Corporate|Business|Editorial)\s+(Address|Office|Headquarters)', ''),
+
+    # Email addresses and phone numbers in footer.
+    ('contact', r'(?i)([a-zA-Z0-9_.+-]+@[a-zA-Z0-9-]+\.[a-zA-Z0-9-.]+)(\s*\.\s*)?$', ''),
+    ('contact', r'(?i)WhatsApp\s+Voice:\s*[\+]?[\d\-\s]+', ''),
+    ('contact', r'(?i)Phone\s*:?\s*[\+]?[\d\-\s]+', ''),
+    ('contact', r'(?i)Call\s+Us\s*(at|on)?\s*:?\s*[\+]?[\d\-\s]+', ''),
+
+    # HTML, CSS or JS fragments.
+    ('markup', r'</?[a-z]+[^>]*>', ''),
+    ('markup', r'\{\{.*?\}\}', ''),
+    ('markup', r'\$\(.*?\)', ''),
+    ('markup', r'function\s*\(.*?\)', ''),
+    ('markup', r'#[a-zA-Z][\w-]*\s*\{[^}]*\}', ''),
+
+    # Urls and website references.
+    ('urls', r'(?i)(Visit|Check)?\s+Our\s+Website:?\s*', ''),
+    ('urls', r'(?i)www\.[a-zA-Z0-9-]+\.[a-zA-Z]{2,}(/[^\s]*)?', ''),
+    ('urls', r'https?://[^\s]+', ''),
+    ('urls', r'(?i)[A-Za-z]+\.(com|org|net|edu|io|ai|co|us|info|news|media)(\s+|$)', ''),
+
+    # Website elements.
+    ('form_words', r'(?i)(Username|Password|Email|Name|First name|Last name|Address|Phone|Submit|Cancel)', ''),
+    ('account_words', r'(?i)(Login|Logout|Sign in|Sign out|Register|Create account)', ''),
+    ('search_words', r'(?i)(Search|Filter|Sort by|Order by)', ''),
+
+    # Pages info.
+    ('pages', r'(?i)Page \d+ of \d+', ''),
+    ('pages', r'(?i)Pages?: \d+(-|–)\d+', ''),
+    ('pages', r'(?i)Results? \d+-\d+ of \d+', ''),
+
+    # Extra section indicators.
+    ('related_words', r'(?i)(Also Read|Related|Similar|More Like This|You May Also Like|Recommended|Popular|Trending)', ''),
+    ('related', r'(?i)(Top|Latest) (Stories|News|Articles)', ''),
+    ('related', r'(?i)(Editor\'s|Our) Picks?', ''),
+
+    # Tags and categories.
+    ('tags', r'(?i)Tags?: .*?(?=\n|$)', ''),
+    ('tags', r'(?i)Categories?: .*?(?=\n|$)', ''),
+    ('tags', r'(?i)Keywords?: .*?(?=\n|$)', ''),
+
+    # Excessive whitespaces.
+    ('whitespace', r' {2,}', ' '),
+    ('whitespace', r'\t+', ' '),
+    ('whitespace', r'\n{3,}', '\n\n'),
+]
+
+# Pattern for lines that were likely headlines repeated within the article.
+title_line_pattern = re.compile(r'^[A-Z][^.!?]*[.!?]$')
+
+# Characters that (?i) matches to an ASCII letter even though lower() maps them elsewhere.
+ignorecase_folds = {0x130: 'i', 0x131: 'i', 0x17f: 's', 0x212a: 'k'}
+
+def fold_case(text):
+    return text.translate(ignorecase_folds).lower()
+
+# Lowercased the literal letters of a pattern while keeping escapes like \S or \Z untouched.
+def lowercase_pattern(pattern):
+    result = []
+    escaped = False
+    for char in pattern:
+        result.append(char if escaped else char.lower())
+        escaped = not escaped and char == '\\'
+    return ''.join(result)
+
+# Compiled each rule once and grouped consecutive rules of the same stage behind one gate.
+# Case-insensitive rules are compiled as lowercase patterns for the folded text, the others run on the text itself.
+# All replacements are whitespace, so they are the same in the text and in its lowercased copy.
+def compile_rules(rules):
+    stages = []
+    for stage_name, pattern, replacement in rules:
+        ignore_case = pattern.startswith('(?i)')
+        matcher = lowercase_pattern(pattern[4:]) if ignore_case else pattern
+        if not stages or stages[-1]['name'] != stage_name or stages[-1]['ignore_case'] != ignore_case:
+            stages.append({'name': stage_name, 'ignore_case': ignore_case, 'rules': [], 'index': len(stages)})
+        stages[-1]['rules'].append({
+            'index': len(stages[-1]['rules']),
+            'pattern': pattern,
+            'regex': re.compile(pattern),
+            'matcher': re.compile(matcher),
+            'replacement': replacement,
+        })
+
+    # A stage with a single rule needs no gate, and broad rules that match almost every article get their own stage.
+    for stage in stages:
+        stage['gate'] = None
+        if len(stage['rules']) > 1:
+            stage['gate'] = re.compile('|'.join('(?:' + rule['matcher'].pattern + ')' for rule in stage['rules']))
+
+    return stages
+
+further_clean_stages = compile_rules(FURTHER_CLEAN_RULES)
+enhanced_clean_stages = compile_rules(ENHANCED_CLEAN_RULES)
+
+# Replaced the given spans in a string.
+def replace_spans(text, spans, replacement):
+    pieces = []
+    last_end = 0
+    for start, end in spans:
+        pieces.append(text[last_end:start])
+        pieces.append(replacement)
+        last_end = end
+    pieces.append(text[last_end:])
+    return ''.join(pieces)
+
+# Applied the stages in order, skipping every stage whose gate finds nothing.
+# progress, when given, gets the index of the running stage and rule (-1 while the gate runs), for the time budget.
+def apply_rules(text, stages, progress=None):
+    folded = fold_case(text)
+    # After the folds lower() keeps every character a single character, if that ever changes the rules run on the text.
+    if len(folded) != len(text):
+        for stage in stages:
+            for rule in stage['rules']:
+                if progress is not None:
+                    progress[0], progress[1] = stage['index'], rule['index']
+                text = rule['regex'].sub(rule['replacement'], text)
+        return text
+
+    for stage in stages:
+        if progress is not None:
+            progress[0], progress[1] = stage['index'], -1
+        if stage['gate'] is not None and stage['gate'].search(folded if stage['ignore_case'] else text) is None:
+            continue
+
+        for rule in stage['rules']:
+            if progress is not None:
+                progress[1] = rule['index']
+            haystack = folded if stage['ignore_case'] else text
+            spans = [match.span() for match in rule['matcher'].finditer(haystack)]
+            if spans:
+                text = replace_spans(text, spans, rule['replacement'])
+                folded = replace_spans(folded, spans, rule['replacement'])
+
+    return text
+
+# Applied the stages like apply_rules, but ran every rule without the gates and timed it, so the cost of each pattern
+# shows up under that rule. The stats are kept per rule across all the articles of a profile run.
+def apply_rules_profiled(text, stages, stats, article, budget_ms):
+    folded = fold_case(text)
+    use_matcher = len(folded) == len(text)
+
+    for stage in stages:
+        for rule in stage['rules']:
+            start = time.perf_counter()
+            if use_matcher:
+                haystack = folded if stage['ignore_case'] else text
+                spans = [match.span() for match in rule['matcher'].finditer(haystack)]
+                if spans:
+                    text = replace_spans(text, spans, rule['replacement'])
+                    folded = replace_spans(folded, spans, rule['replacement'])
+                matches = len(spans)
+            else:
+                text, matches = rule['regex'].subn(rule['replacement'], text)
+            elapsed = time.perf_counter() - start
+
+            rule_stats = stats.setdefault(id(rule), {
+                'stage': stage['name'], 'pattern': rule['pattern'], 'seconds': 0.0, 'matches': 0,
+                'articles_matched': 0, 'worst_seconds': 0.0, 'worst_article': None, 'articles_over_budget': 0,
+            })
+            rule_stats['seconds'] += elapsed
+            rule_stats['matches'] += matches
+            rule_stats['articles_matched'] += matches > 0
+            if elapsed > rule_stats['worst_seconds']:
+                rule_stats['worst_seconds'] = elapsed
+                rule_stats['worst_article'] = article
+            if elapsed * 1000 > budget_ms:
+                rule_stats['articles_over_budget'] += 1
+
+    return text
+
+profile_columns = ['stage', 'pattern', 'seconds', 'ms_per_article', 'matches', 'articles_matched',
+                   'worst_ms', 'worst_article', 'articles_over_budget', 'over_budget']
+
+# Profiled a rule set on some articles and returned the rules ranked by total time. The worst article is the index
+# label of the article the rule was slowest on, and rules that went over the budget on any article are flagged.
+def profile_rules(texts, stages, budget_ms=None):
+    budget_ms = rule_time_budget_ms if budget_ms is None else budget_ms
+    texts = texts if isinstance(texts, pd.Series) else pd.Series(list(texts))
+    stats = {}
+    for article, text in texts.items():
+        if isinstance(text, str) and text:
+            apply_rules_profiled(text, stages, stats, article, budget_ms)
+
+    # Without a single non-empty text there is nothing to rank, the frame is returned empty with the same columns.
+    if not stats:
+        print("No non-empty texts in the sample, nothing to profile")
+        return pd.DataFrame(columns=profile_columns)
+
+    profile = pd.DataFrame(list(stats.values()))
+    profile['ms_per_article'] = profile['seconds'] * 1000 / max(len(texts), 1)
+    profile['worst_ms'] = profile['worst_seconds'] * 1000
+    profile['over_budget'] = profile['articles_over_budget'] > 0
+    profile = profile.sort_values('seconds', ascending=False).reset_index(drop=True)
+    return profile[profile_columns]
+
+def print_rule_profile(profile, label, top=15):
+    if profile.empty:
+        print(f"No {label} rules were profiled")
+        return
+    print(f"Slowest {label} rules:")
+    report = profile.head(top).copy()
+    report['pattern'] = report['pattern'].str.slice(0, 60)
+    print(report.to_string(index=False))
+    flagged = profile[profile['over_budget']]
+    if len(flagged):
+        print(f"{len(flagged)} {label} rules went over the per-article budget:")
+        for _, row in flagged.iterrows():
+            print(f"  [{row['stage']}] {row['pattern'][:80]} - {row['articles_over_budget']} articles, "
+                  f"worst {row['worst_ms']:.1f} ms on article {row['worst_article']}")
+
+# The rule sets without their whitespace stage, scan_lines collapses the whitespace while it filters the lines.
+rule_sets = {
+    'further': [stage for stage in further_clean_stages if stage['name'] != 'whitespace'],
+    'enhanced': [stage for stage in enhanced_clean_stages if stage['name'] != 'whitespace'],
+}
+
+class RuleTimeout(Exception):
+    pass
+
+# Articles that went over the time budget in this run, with the rule that was running when the time ran out.
+quarantined_articles = []
+
+# The stages without the excluded rules, given as (stage index, rule index). A rule index of -1 is the gate of the
+# stage, then the whole stage is left out.
+def reduced_stages(stages, excluded):
+    excluded = set(excluded)
+    reduced = []
+    for stage in stages:
+        if (stage['index'], -1) in excluded:
+            continue
+        rules = [rule for rule in stage['rules'] if (stage['index'], rule['index']) not in excluded]
+        if len(rules) == len(stage['rules']):
+            reduced.append(stage)
+        elif rules:
+            reduced.append({**stage, 'rules': rules, 'gate': None})
+    return reduced
+
+# Ran the rules with re2, rules that use syntax re2 does not support (lookarounds) are left out.
+def apply_rules_re2(text, stages):
+    for stage in stages:
+        for rule in stage['rules']:
+            if 're2' not in rule:
+                try:
+                    rule['re2'] = re2.compile(rule['pattern'])
+                except Exception:
+                    rule['re2'] = None
+            if rule['re2'] is not None:
+                text = rule['re2'].sub(rule['replacement'], text)
+    return text
+
+# The regex engine only checks for interrupts every few thousand steps and one step can scan the whole article, so a
+# timer in this process cannot stop a slow rule in time. The rules run in a worker process instead, which is stopped
+# when an article goes over the budget. The worker writes the running stage and rule to shared memory.
+budget_workers = {}
+
+def budget_worker_loop(connection, rule_set, progress):
+    stages = rule_sets[rule_set]
+    connection.send('ready')
+    while True:
+        message = connection.recv()
+        if message is None:
+            break
+        text, use_re2, excluded = message
+        if use_re2:
+            connection.send(apply_rules_re2(text, stages))
+        else:
+            connection.send(apply_rules(text, reduced_stages(stages, excluded), progress))
+
+def start_budget_worker(rule_set):
+    progress = multiprocessing.RawArray('i', 2)
+    connection, worker_connection = multiprocessing.Pipe()
+    process = multiprocessing.Process(target=budget_worker_loop, args=(worker_connection, rule_set, progress),
+                                      daemon=True)
+    process.start()
+    # Waiting for the worker to be ready so its start up does not count against the first article.
+    connection.recv()
+    budget_workers[rule_set] = (process, connection, progress)
+
+def stop_budget_workers():
+    for process, connection, _ in budget_workers.values():
+        connection.send(None)
+        process.join()
+    budget_workers.clear()
+
+# Cleaned one article in the worker and stopped the worker if the answer did not come within the budget.
+def run_in_budget_worker(rule_set, message, budget_ms):
+    if rule_set not in budget_workers:
+        start_budget_worker(rule_set)
+    process, connection, progress = budget_workers[rule_set]
+
+    progress[0], progress[1] = -1, -1
+    connection.send(message)
+    if connection.poll(budget_ms / 1000):
+        return connection.recv()
+
+    process.kill()
+    process.join()
+    del budget_workers[rule_set]
+    raise RuleTimeout(progress[0], progress[1])
+
+# Applied a rule set within the per-article time budget. When the budget runs out the article is cleaned again with
+# re2, or without the rule that was running, under the same budget. If that also runs out the rules are skipped for
+# this article, so one article never takes more than twice the budget plus the restart of the worker.
+def apply_rules_within_budget(text, rule_set, budget_ms=None):
+    budget_ms = article_time_budget_ms if budget_ms is None else budget_ms
+    stages = rule_sets[rule_set]
+    if budget_ms is None:
+        return apply_rules(text, stages)
+
+    start = time.perf_counter()
+    try:
+        return run_in_budget_worker(rule_set, (text, False, []), budget_ms)
+    except RuleTimeout as timeout:
+        stage_index, rule_index = timeout.args
+
+    entry = {'key': text_hash(text), 'preview': text[:80], 'stage': None, 'rule': None}
+    if stage_index >= 0:
+        entry['stage'] = stages[stage_index]['name']
+        entry['rule'] = stages[stage_index]['rules'][rule_index]['pattern'] if rule_index >= 0 else 'stage gate'
+
+    try:
+        if re2 is not None:
+            entry['fallback'] = 're2'
+            cleaned = run_in_budget_worker(rule_set, (text, True, []), budget_ms)
+        elif stage_index >= 0:
+            entry['fallback'] = 'reduced rules'
+            cleaned = run_in_budget_worker(rule_set, (text, False, [(stage_index, rule_index)]), budget_ms)
+        else:
+            raise RuleTimeout(-1, -1)
+    except RuleTimeout:
+        entry['fallback'] = 'no rules'
+        cleaned = text
+
+    entry['elapsed_ms'] = (time.perf_counter() - start) * 1000
+    quarantined_articles.append(entry)
+    return cleaned
+
+# Articles that went over the budget are not stored in the cleaning cache, their result depends on how long the rules took.
+def quarantined_keys():
+    return {entry['key'] for entry in quarantined_articles}
+
+def print_quarantine_summary():
+    if not quarantined_articles:
+        return
+    quarantine = pd.DataFrame(quarantined_articles)
+    print(f"{len(quarantine)} articles went over the {article_time_budget_ms} ms budget:")
+    print(quarantine.groupby(['stage', 'rule', 'fallback'], dropna=False).size().sort_values(ascending=False).to_string())
+
+multiple_spaces_pattern = re.compile(r' {2,}')
+tabs_pattern = re.compile(r'\t+')
+
+# Both cleaners end by collapsing whitespace and then split and join the lines again to drop the short ones and,
+# for the enhanced one, the repeated headlines. I do all of it in one pass over the lines: spaces and tabs are
+# collapsed inside the line, a run of empty lines becomes one, short lines are dropped and repeated titles skipped.
+# Runs of empty lines at the start and end are left to the strip() that follows.
+def scan_lines(text, collapse_tabs=False, skip_repeated_titles=False):
+    seen_titles = set()
+    empty_lines = 0
+    start = 0
+    while start <= len(text):
+        end = text.find('\n', start)
+        if end < 0:
+            end = len(text)
+        line = text[start:end]
+        start = end + 1
+
+        if not line:
+            empty_lines += 1
+            continue
+        if empty_lines:
+            yield ''
+            empty_lines = 0
+
+        if '  ' in line:
+            line = multiple_spaces_pattern.sub(' ', line)
+        if collapse_tabs and '\t' in line:
+            line = tabs_pattern.sub(' ', line)
+        line_stripped = line.strip()
+        if line_stripped and len(line_stripped) <= 15:
+            continue
+        if skip_repeated_titles and len(line_stripped) < 100 and title_line_pattern.match(line_stripped):
+            if line_stripped in seen_titles:
+                continue
+            seen_titles.add(line_stripped)
+        yield line
+
+# Same output as further_clean_text using the compiled rules.
+def staged_further_clean_text(text):
+    if not text or pd.isna(text):
+        return ""
+
+    text = apply_rules_within_budget(str(text), 'further')
+    return '\n'.join(scan_lines(text)).strip()
+
+# Same output as enhanced_clean_text using the compiled rules.
+def staged_enhanced_clean_text(text):
+    if not text or pd.isna(text):
+        return ""
+
+    text = apply_rules_within_budget(str(text), 'enhanced')
+    return '\n'.join(scan_lines(text, collapse_tabs=True, skip_repeated_titles=True)).strip()
+
+# The line passes the cleaners used before scan_lines, on text that already went through the other rules.
+def split_join_lines(text, whitespace_stages, skip_repeated_titles=False):
+    text = apply_rules(text, whitespace_stages)
+    lines = text.split('\n')
+    cleaned_lines = [line for line in lines if len(line.strip()) > 15 or line.strip() == '']
+
+    if skip_repeated_titles:
+        non_title_lines = []
+        seen_titles = set()
+        for line in cleaned_lines:
+            line_stripped = line.strip()
+            if title_line_pattern.match(line_stripped) and len(line_stripped) < 100:
+                if line_stripped in seen_titles:
+                    continue
+                seen_titles.add(line_stripped)
+            non_title_lines.append(line)
+        cleaned_lines = non_title_lines
+
+    return '\n'.join(cleaned_lines).strip()
+
+# Compared scan_lines with the split and join passes on the same texts, checking they give the same output.
+def benchmark_line_scanner(texts, repeat=3):
+    texts = [str(text) for text in texts if isinstance(text, str) and text]
+    total_mb = sum(len(text) for text in texts) / (1024 * 1024)
+    results = []
+    for label, rule_set, stages, options in [
+        ('further_clean_text', 'further', further_clean_stages, {}),
+        ('enhanced_clean_text', 'enhanced', enhanced_clean_stages, {'collapse_tabs': True, 'skip_repeated_titles': True}),
+    ]:
+        whitespace_stages = [stage for stage in stages if stage['name'] == 'whitespace']
+        ruled = [apply_rules(text, rule_sets[rule_set]) for text in texts]
+        titles = options.get('skip_repeated_titles', False)
+        mismatches = sum(split_join_lines(text, whitespace_stages, titles) != '\n'.join(scan_lines(text, **options)).strip()
+                         for text in ruled)
+
+        timings = {}
+        for version, func in [
+            ('split and join', lambda text: split_join_lines(text, whitespace_stages, titles)),
+            ('scan_lines', lambda text: '\n'.join(scan_lines(text, **options)).strip()),
+        ]:
+            best = None
+            for _ in range(repeat):
+                start = time.perf_counter()
+                for text in ruled:
+                    func(text)
+                elapsed = time.perf_counter() - start
+                best = elapsed if best is None else min(best, elapsed)
+            timings[version] = best
+            results.append({'cleaner': label, 'version': version, 'seconds': best,
+                            'mb_per_sec': total_mb / best if best > 0 else float('inf'), 'mismatches': mismatches})
+        print(f"{label} line pass speedup: {timings['split and join'] / timings['scan_lines']:.2f}x, {mismatches} mismatches")
+
+    results = pd.DataFrame(results)
+    print(results.to_string(index=False))
+    return results
+
+# Original and staged version of each cleaner.
+staged_cleaners = [
+    ('further_clean_text', further_clean_text, staged_further_clean_text),
+    ('enhanced_clean_text', enhanced_clean_text, staged_enhanced_clean_text),
+]
+
+# Checked that the staged cleaners return exactly the same text as the original ones on a reference corpus.
+def check_cleaning_parity(texts):
+    all_match = True
+    for name, original, staged in staged_cleaners:
+        mismatches = [i for i, text in enumerate(texts) if original(text) != staged(text)]
+        print(f"{name}: {len(texts) - len(mismatches)}/{len(texts)} identical")
+        if mismatches:
+            all_match = False
+            print(f"First mismatching articles: {mismatches[:5]}")
+    return all_match
+
+# Measured articles/sec and MB/sec for the original and the staged cleaners.
+def benchmark_cleaning(texts, repeat=3):
+    texts = [text for text in texts if isinstance(text, str)]
+    total_mb = sum(len(text.encode('utf-8')) for text in texts) / (1024 * 1024)
+
+    results = []
+    for name, original, staged in staged_cleaners:
+        for label, func in [('original', original), ('staged', staged)]:
+            best = None
+            for _ in range(repeat):
+                start = time.perf_counter()
+                for text in texts:
+                    func(text)
+                elapsed = time.perf_counter() - start
+                best = elapsed if best is None else min(best, elapsed)
+            results.append({
+                'cleaner': name,
+                'version': label,
+                'seconds': best,
+                'articles_per_sec': len(texts) / best if best > 0 else float('inf'),
+                'mb_per_sec': total_mb / best if best > 0 else float('inf'),
+            })
+
+    results = pd.DataFrame(results)
+    print(f"Benchmark on {len(texts)} articles ({total_mb:.1f} MB):")
+    print(results.to_string(index=False))
+    for name in results['cleaner'].unique():
+        subset = results[results['cleaner'] == name].set_index('version')
+        print(f"{name} speedup: {subset.loc['original', 'seconds'] / subset.loc['staged', 'seconds']:.2f}x")
+    return results
+
+# Ran the parity check and the benchmark on a random sample of the cached input.
+def benchmark_on_cached_data(sample_size=benchmark_sample_size):
+    df = load_from_cache(input_file)
+    if df is None:
+        print(f"Error: Input file {get_cache_path(input_file)} not found.")
+        return None
+
+    column = 'cleaned_text' if 'cleaned_text' in df.columns else 'text'
+    texts = df[column].sample(min(sample_size, len(df)), random_state=42).tolist()
+
+    if not check_cleaning_parity(texts):
+        print("Warning: the staged cleaners do not match the original ones on this sample.")
+    results = benchmark_cleaning(texts)
+
+    # The line pass matters most on the longest articles.
+    longest = df[column].dropna().str.len().nlargest(min(200, len(df))).index
+    benchmark_line_scanner(df.loc[longest, column].tolist())
+    return results
+
+# Version of the further cleaning, the rules and every function staged_further_clean_text goes through.
+def further_clean_version():
+    return cleaner_version(
+        staged_further_clean_text, apply_rules, replace_spans, fold_case, lowercase_pattern, compile_rules,
+        ignorecase_folds, FURTHER_CLEAN_RULES, scan_lines, multiple_spaces_pattern,
+    )
+
+def further_clean_texts(texts):
+    return ([staged_further_clean_text(text) for text in texts],)
+
+# Profiled both rule sets on a random sample of the cached input.
+def profile_on_cached_data(sample_size=profile_sample_size):
+    df = load_from_cache(input_file)
+    if df is None:
+        print(f"Error: Input file {get_cache_path(input_file)} not found.")
+        return None
+
+    column = 'cleaned_text' if 'cleaned_text' in df.columns else 'text'
+    texts = df[column].sample(min(sample_size, len(df)), random_state=42)
+
+    profiles = {}
+    for label, stages in [('further_clean_text', further_clean_stages), ('enhanced_clean_text', enhanced_clean_stages)]:
+        profiles[label] = profile_rules(texts, stages)
+        print_rule_profile(profiles[label], label)
+    return profiles
+
+# Wire stories and press releases are published again by many sites with small edits, so the exact deduplication
+# above misses most copies. I compared the articles with MinHash: every article gets a signature of the smallest hash
+# of its word shingles under minhash_permutations hash functions, and two signatures agree in about the Jaccard
+# similarity of the shingle sets. LSH banding only compares articles that agree on a whole band of the signature, so
+# the comparison is close to linear. The signatures are written to a memory mapped file in the cache and the bands are
+# read one at a time, so the memory used stays a few dozen bytes per article.
+word_pattern = re.compile(r'\w+')
+
+# Fixed seed so an article gets the same signature in every run.
+minhash_rng = np.random.default_rng(2024)
+minhash_multipliers = minhash_rng.integers(1, 2 ** 63, size=minhash_permutations, dtype=np.uint64) * np.uint64(2) + np.uint64(1)
+minhash_offsets = minhash_rng.integers(0, 2 ** 63, size=minhash_permutations, dtype=np.uint64)
+shingle_multipliers = minhash_rng.integers(1, 2 ** 63, size=shingle_words, dtype=np.uint64) * np.uint64(2) + np.uint64(1)
+
+# Hashed the word shingles of a chunk of texts in one pass. A text shorter than shingle_words is one shingle.
+# Returned the shingle hashes and the number of shingles of every text.
+def shingle_hashes(texts):
+    words = [word_pattern.findall(text.lower()) if isinstance(text, str) else [] for text in texts]
+    lengths = np.fromiter(map(len, words), dtype=np.int64, count=len(words))
+    word_hashes = pd.util.hash_array(np.array([word for text_words in words for word in text_words], dtype=object))
+    articles = np.repeat(np.arange(len(texts)), lengths)
+
+    total = len(word_hashes)
+    shingles = np.zeros(total, dtype=np.uint64)
+    for k in range(shingle_words):
+        same_article = articles[k:] == articles[:total - k]
+        shingles[:total - k] += np.where(same_article, word_hashes[k:] * shingle_multipliers[k], np.uint64(0))
+
+    # Kept the shingles that start early enough to be complete, or the first one of a short text.
+    starts = np.cumsum(lengths) - lengths
+    position = np.arange(total) - np.repeat(starts, lengths)
+    last_start = np.maximum(lengths - shingle_words, 0)
+    keep = position <= np.repeat(last_start, lengths)
+    return shingles[keep], np.where(lengths > 0, last_start + 1, 0)
+
+# Signature of every text, a text without words keeps the maximum value everywhere and matches nothing.
+def minhash_signatures(texts, signatures):
+    shingles, counts = shingle_hashes(texts)
+    signatures[:] = np.iinfo(np.uint32).max
+    has_shingles = counts > 0
+    if not has_shingles.any():
+        return
+    offsets = (np.cumsum(counts) - counts)[has_shingles]
+    rows = np.flatnonzero(has_shingles)
+    # One permutation at a time in the same buffer. The top 32 bits are taken after the minimum, which is the same.
+    hashed = np.empty_like(shingles)
+    for permutation in range(minhash_permutations):
+        np.multiply(shingles, minhash_multipliers[permutation], out=hashed)
+        hashed += minhash_offsets[permutation]
+        signatures[rows, permutation] = np.minimum.reduceat(hashed, offsets) >> np.uint64(32)
+
+# Roots of the items in an int32 parent array, one step up the trees for all of them at a time. The items are pointed
+# straight at their roots afterwards.
+def find_roots(parents, items):
+    roots = parents[items]
+    while True:
+        grandparents = parents[roots]
+        if (grandparents == roots).all():
+            break
+        roots = grandparents
+    parents[items] = roots
+    return roots
+
+# Joined the clusters of every pair. The larger root is hooked onto the smaller one, so a parent always comes before its
+# children. When several pairs hook the same root only the smallest target is kept and the other pairs are joined in
+# the next round.
+def union_pairs(parents, firsts, others):
+    while len(firsts):
+        roots_first, roots_other = find_roots(parents, firsts), find_roots(parents, others)
+        apart = roots_first != roots_other
+        np.minimum.at(parents, np.maximum(roots_first, roots_other)[apart], np.minimum(roots_first, roots_other)[apart])
+        firsts, others = firsts[apart], others[apart]
+
+# Grouped the texts into clusters of near duplicates, returned the cluster root of every text.
+# The matching pairs of a band are joined together with numpy, and pairs that an earlier band already put in the same
+# cluster are not compared again.
+def near_duplicate_clusters(signatures, threshold=None, bands=None):
+    threshold = threshold or near_duplicate_threshold
+    bands = bands or lsh_bands
+    rows_per_band = signatures.shape[1] // bands
+    parents = np.arange(len(signatures), dtype=np.int32)
+    candidates = 0
+    # Texts without words have the same signature but are not copies of each other.
+    empty = (signatures[:, :rows_per_band] == np.iinfo(np.uint32).max).all(axis=1)
+    for band in range(bands):
+        band_hashes = np.zeros(len(signatures), dtype=np.uint64)
+        for column in range(band * rows_per_band, (band + 1) * rows_per_band):
+            band_hashes = band_hashes * np.uint64(0x100000001b3) + signatures[:, column]
+        order = np.argsort(band_hashes, kind='stable')
+        sorted_hashes = band_hashes[order]
+        same_as_previous = np.flatnonzero(sorted_hashes[1:] == sorted_hashes[:-1]) + 1
+        if len(same_as_previous) == 0:
+            continue
+        # Every article in a bucket is compared with the first article of the bucket.
+        bucket_starts = np.flatnonzero(np.r_[True, sorted_hashes[1:] != sorted_hashes[:-1]])
+        bucket_of = np.searchsorted(bucket_starts, same_as_previous, side='right') - 1
+        firsts = order[bucket_starts[bucket_of]]
+        others = order[same_as_previous]
+        words = ~empty[firsts] & ~empty[others]
+        firsts, others = firsts[words], others[words]
+        candidates += len(others)
+        apart = find_roots(parents, firsts) != find_roots(parents, others)
+        firsts, others = firsts[apart], others[apart]
+        matches = np.zeros(len(firsts), dtype=bool)
+        for start in range(0, len(others), minhash_chunk_size):
+            first = firsts[start:start + minhash_chunk_size]
+            other = others[start:start + minhash_chunk_size]
+            matches[start:start + len(first)] = (signatures[first] == signatures[other]).mean(axis=1) >= threshold
+        union_pairs(parents, firsts[matches], others[matches])
+    print(f"Near duplicates: {candidates} candidate pairs in {bands} bands")
+    return find_roots(parents, np.arange(len(parents)))
+
+# Kept the longest article of every cluster and recorded how many rows it stands for. Rows with the same text are
+# signed once and end up in the same cluster.
+def drop_near_duplicates(df, text_column):
+    start = time.perf_counter()
+    codes, texts = factorize_column(df[text_column])
+    path = get_cache_path("minhash_signatures.npy")
+    signatures = np.lib.format.open_memmap(path, mode='w+', dtype=np.uint32,
+                                           shape=(len(texts), minhash_permutations))
+    try:
+        for chunk_start in range(0, len(texts), minhash_chunk_size):
+            chunk = texts[chunk_start:chunk_start + minhash_chunk_size]
+            minhash_signatures(chunk, signatures[chunk_start:chunk_start + len(chunk)])
+        signatures.flush()
+        clusters = near_duplicate_clusters(signatures)[codes]
+    finally:
+        del signatures
+        os.remove(path)
+
+    rows = pd.DataFrame({'cluster': clusters, 'length': df[text_column].str.len().fillna(0).to_numpy(),
+                         'position': np.arange(len(df))})
+    cluster_sizes = rows['cluster'].value_counts()
+    representatives = rows.sort_values(['cluster', 'length', 'position'], ascending=[True, False, True]) \
+        .drop_duplicates('cluster').set_index('cluster')['position']
+
+    mapping = pd.DataFrame({'representative': df.index[representatives.loc[clusters].to_numpy()],
+                            'cluster_size': cluster_sizes.loc[clusters].to_numpy()}, index=df.index)
+    save_to_cache(mapping, near_duplicates_file)
+
+    kept_positions = np.sort(representatives.to_numpy())
+    kept = df.iloc[kept_positions].copy()
+    kept['cluster_size'] = cluster_sizes.loc[clusters[kept_positions]].to_numpy()
+    print(f"Near duplicates: kept {len(kept)} of {len(df)} articles, {len(df) - len(kept)} copies in "
+          f"{int((cluster_sizes > 1).sum())} clusters removed in {time.perf_counter() - start:.1f}s")
+    return kept
+
 #  Cleaned the title to remove publisher names and noise.
 def further_clean_title(title):
     if not title or pd.isna(title):
@@ -344,20 +1232,19 @@ def enhanced_clean_title(title):
 
 # Here I loaded my previously cleaned data and applied further cleaning.
 def process_cleaned_dataset():
-    # Checked if the input file existed.
-    if not os.path.exists(input_file):
-        print(f"Error: Input file {input_file} not found. Make sure you've run your original cleaning script first.")
-        return None
-    
     # Loaded the dataset.
-    print(f"Loading cached dataset from {input_file}...")
+    print(f"Loading cached dataset from {get_cache_path(input_file)}...")
     try:
-        with open(input_file, 'rb') as f:
-            df = pickle.load(f)
-        print(f"Dataset loaded successfully. Shape: {df.shape}")
+        df = load_from_cache(input_file)
     except Exception as e:
         print(f"Error loading dataset: {e}")
         return None
+
+    # Checked if the input file existed.
+    if df is None:
+        print(f"Error: Input file {get_cache_path(input_file)} not found. Make sure you've run your original cleaning script first.")
+        return None
+    print(f"Dataset loaded successfully. Shape: {df.shape}")
     
     # Using a copy to preserve the original.
     df_clean = df.copy()
@@ -365,31 +1252,60 @@ def process_cleaned_dataset():
     # Applied extra cleaning to text.
     print("Extra cleaning.")
     if 'cleaned_text' in df_clean.columns:
-        df_clean['trafilatura_text'] = df_clean['cleaned_text'].apply(further_clean_text)
+        text_column = 'cleaned_text'
     else:
         print("Warning: 'cleaned_text' column not found. Looking for 'text' column instead.")
         if 'text' in df_clean.columns:
-            df_clean['trafilatura_text'] = df_clean['text'].apply(further_clean_text)
+            text_column = 'text'
         else:
             print("Error: Neither 'cleaned_text' nor 'text' column found.")
             return None
+
+    source_texts = df_clean[text_column].tolist()
+
+    quarantined_articles.clear()
+    start = time.perf_counter()
+    if dedup_cleaning:
+        codes, texts = factorize_column(source_texts)
+    else:
+        texts = source_texts
+
+    if use_cleaning_cache:
+        cleaned = cached_clean(texts, 'further_clean', further_clean_version(), further_clean_texts,
+                               ['trafilatura_text'], excluded_keys=quarantined_keys)[0]
+    else:
+        cleaned = further_clean_texts(texts)[0]
+    sentences = [sentence_offsets(text) if isinstance(text, str) else ([], []) for text in cleaned]
+    sentence_starts = [starts for starts, _ in sentences]
+    sentence_ends = [ends for _, ends in sentences]
+
+    if dedup_cleaning:
+        report_dedup("Text cleaning", len(codes), len(texts), time.perf_counter() - start)
+        cleaned = broadcast_unique(cleaned, codes)
+        sentence_starts = broadcast_unique(sentence_starts, codes)
+        sentence_ends = broadcast_unique(sentence_ends, codes)
+    df_clean['trafilatura_text'] = cleaned
+    df_clean['trafilatura_sentence_starts'] = sentence_offset_column(sentence_starts, df_clean.index)
+    df_clean['trafilatura_sentence_ends'] = sentence_offset_column(sentence_ends, df_clean.index)
+    stop_budget_workers()
+    print_quarantine_summary()
     
     # Applied extra cleaning to the title.
     print("Applying further title cleaning...")
     if 'title' in df_clean.columns:
-        df_clean['trafilatura_title'] = df_clean['title'].apply(further_clean_title)
+        if dedup_cleaning:
+            df_clean['trafilatura_title'] = apply_unique(df_clean['title'], further_clean_title, "Title cleaning")
+        else:
+            df_clean['trafilatura_title'] = df_clean['title'].apply(further_clean_title)
     else:
         print("Warning: 'title' column not found.")
         df_clean['trafilatura_title'] = ["Unknown Title" for _ in range(len(df_clean))]
+
+    if remove_near_duplicates:
+        df_clean = drop_near_duplicates(df_clean, 'trafilatura_text')
     
-    # Saved the new cleaned dataset.
-    print(f"Saving further cleaned dataset to {output_file}...")
-    with open(output_file, 'wb') as f:
-        pickle.dump(df_clean, f)
-    print(f"Dataset saved successfully.")
-    
-    # Saved a minimal version with just the essential columns.
-    minimal_cols = ['trafilatura_title', 'trafilatura_text']
+    # Saved a minimal view with just the essential columns.
+    minimal_cols = ['trafilatura_title', 'trafilatura_text', 'trafilatura_sentence_starts', 'trafilatura_sentence_ends']
     if 'date' in df_clean.columns:
         minimal_cols.append('date')
     if 'year' in df_clean.columns:
@@ -400,80 +1316,139 @@ def process_cleaned_dataset():
         minimal_cols.append('yearmonth')
     if 'source_domain' in df_clean.columns:
         minimal_cols.append('source_domain')
-    
-    minimal_file = os.path.join(cache_dir, "trafilatura_quality_minimal.pkl")
-    df_minimal = df_clean[minimal_cols].copy()
-    
-    with open(minimal_file, 'wb') as f:
-        pickle.dump(df_minimal, f)
-    print(f"Minimal dataset saved to {minimal_file}")
+    if 'cluster_size' in df_clean.columns:
+        minimal_cols.append('cluster_size')
+
+    # Saved the new cleaned dataset, the minimal version is a view of it instead of a second file.
+    print(f"Saving further cleaned dataset to {get_cache_path(output_file)}...")
+    save_to_cache(df_clean, output_file, views={'minimal': minimal_cols})
+    print(f"Dataset saved successfully.")
     
     # Checked the first rows.
     return df_clean[['trafilatura_title', 'trafilatura_text']].head()
 
-# Analyzed the differences between the original and latest cleaned text.
-def analyze_cleaning_differences(df_sample=5):
+# Loaded one text column of a cached dataset, with the first of the names that exists. With an Arrow file only that
+# column is read from the memory mapped file, the strings stay in Arrow memory. Extra columns the Arrow file does not
+# have are left out.
+def load_text_column(filename, names, extra_columns=()):
+    stored_columns = get_cache_columns(filename)
+    if stored_columns:
+        extra_columns = [column for column in extra_columns if column in stored_columns]
+    for name in names:
+        for extra in (list(extra_columns), []):
+            try:
+                df = load_from_cache(filename, columns=[name] + extra)
+            except KeyError:
+                continue
+            return df, name
+    return None, None
+
+# Analyzed how much the further cleaning removed over the whole corpus. The lengths are computed by Arrow on the two
+# text columns, and the rows are matched on their index since the near duplicates are no longer in the output.
+# A sample of the articles is printed with the original and cleaned title and text.
+def analyze_cleaning_differences(df_sample=5, top_domains=10, min_domain_articles=20):
     try:
-        with open(input_file, 'rb') as f:
-            df = pickle.load(f)
-        
-        with open(output_file, 'rb') as f:
-            df_clean = pickle.load(f)
-        
-        # Selected the columns for comparison.
-        title_cols = ['title', 'trafilatura_title'] if 'title' in df.columns else ['trafilatura_title']
-        text_cols = ['cleaned_text', 'trafilatura_text'] if 'cleaned_text' in df.columns else ['trafilatura_text']
-        
-        # Random sample.
-        sample_idx = df.sample(df_sample).index
-        
+        start = time.perf_counter()
+        before, before_column = load_text_column(input_file, ['cleaned_text', 'text'], extra_columns=['title'])
+        after, _ = load_text_column(output_file, ['trafilatura_text'], extra_columns=['source_domain', 'trafilatura_title'])
+        if before is None or after is None:
+            print("Error analyzing cleaning differences: the input or output text column was not found.")
+            return None
+
+        # Position in the input of every output row. Labels only identify a row when the input index is unique, an
+        # input with repeated labels can only be matched by position while no rows were removed.
+        if before.index.is_unique:
+            positions = before.index.get_indexer(after.index)
+        elif len(before) == len(after):
+            print("The input index has repeated labels, the rows are matched by position.")
+            positions = np.arange(len(after))
+        else:
+            print("Error analyzing cleaning differences: the input index has repeated labels and rows were removed, "
+                  "the output rows cannot be matched to the input.")
+            return None
+
+        before_lengths = before[before_column].str.len().fillna(0).astype('int64').to_numpy()
+        audit = pd.DataFrame({
+            'before': np.where(positions >= 0, before_lengths[positions], 0),
+            'after': after['trafilatura_text'].str.len().fillna(0).astype('int64').to_numpy(),
+        }, index=after.index)
+        audit['removed'] = audit['before'] - audit['after']
+        audit['reduction'] = audit['removed'] / audit['before'].where(audit['before'] > 0)
+        if 'source_domain' in after.columns:
+            audit['source_domain'] = after['source_domain']
+
+        print("\n" + "="*80)
+        print("Cleaning audit.")
+        print("="*80)
+        total_before = audit['before'].sum()
+        total_after = audit['after'].sum()
+        print(f"Articles: {len(audit)} cleaned ({len(before) - len(audit)} of the {len(before)} input articles "
+              f"removed as near duplicates)")
+        print(f"Characters: {total_before:,} -> {total_after:,} "
+              f"({(total_before - total_after) / max(total_before, 1):.1%} removed)")
+        print(f"Unchanged: {(audit['removed'] == 0).sum()}, emptied: {((audit['after'] == 0) & (audit['before'] > 0)).sum()}, "
+              f"longer than before: {(audit['removed'] < 0).sum()}")
+
+        percentiles = audit['reduction'].quantile([0.1, 0.25, 0.5, 0.75, 0.9, 0.99, 1.0])
+        print("Reduction per article: " + ", ".join(
+            f"p{int(q * 100)} {value:.1%}" for q, value in percentiles.items()))
+
+        if 'source_domain' in audit.columns:
+            domains = audit.groupby('source_domain', observed=True).agg(
+                articles=('reduction', 'size'),
+                mean_reduction=('reduction', 'mean'),
+                removed=('removed', 'sum'),
+            )
+            domains = domains[domains['articles'] >= min_domain_articles]
+            print(f"\nMost affected domains (at least {min_domain_articles} articles):")
+            print(domains.sort_values('mean_reduction', ascending=False).head(top_domains).to_string(
+                formatters={'mean_reduction': '{:.1%}'.format, 'removed': '{:,}'.format}))
+
+        # Only the sampled rows are turned into Python strings. The sample is drawn from the row positions of the
+        # output, so repeated labels still select one row.
+        sample_rows = pd.Series(np.arange(len(audit))).sample(min(df_sample, len(audit))).tolist()
+        sample_rows = [row for row in sample_rows if positions[row] >= 0]
+
         print("\n" + "="*80)
         print("Comparing title cleaning.")
         print("="*80)
-        
-        for idx in sample_idx:
-            if len(title_cols) > 1:
-                print(f"\nOriginal title: {df.loc[idx, title_cols[0]]}")
-                print(f"Cleaned title:  {df_clean.loc[idx, title_cols[1]]}")
-            else:
-                print(f"\nCleaned title:  {df_clean.loc[idx, title_cols[0]]}")
+        for row in sample_rows:
+            if 'title' in before.columns and 'trafilatura_title' in after.columns:
+                print(f"\nOriginal title: {before['title'].iloc[positions[row]]}")
+                print(f"Cleaned title:  {after['trafilatura_title'].iloc[row]}")
+            elif 'trafilatura_title' in after.columns:
+                print(f"\nCleaned title:  {after['trafilatura_title'].iloc[row]}")
             print("-"*80)
-        
+
         print("\n" + "="*80)
         print("Comparing text cleaning.")
         print("="*80)
-        
-        for idx in sample_idx:
-            if len(text_cols) > 1:
-                orig_text = df.loc[idx, text_cols[0]]
-                clean_text = df_clean.loc[idx, text_cols[1]]
-                
-                print(f"\nOriginal text (first 200 chars):")
-                print(f"{orig_text[:200]}..." if len(orig_text) > 200 else orig_text)
-                
-                print(f"\nCleaned text (first 200 chars):")
-                print(f"{clean_text[:200]}..." if len(clean_text) > 200 else clean_text)
-                
-                # Calculate character reduction percentage
-                orig_len = len(orig_text)
-                clean_len = len(clean_text)
-                reduction = ((orig_len - clean_len) / orig_len) * 100 if orig_len > 0 else 0
-                
-                print(f"\nCharacter count: {orig_len} → {clean_len} ({reduction:.1f}% reduction)")
-            else:
-                clean_text = df_clean.loc[idx, text_cols[0]]
-                print(f"\nCleaned text (first 200 chars):")
-                print(f"{clean_text[:200]}..." if len(clean_text) > 200 else clean_text)
-            
+        for row in sample_rows:
+            orig_text = before[before_column].iloc[positions[row]]
+            orig_text = orig_text if isinstance(orig_text, str) else ""
+            clean_text = after['trafilatura_text'].iloc[row]
+            clean_text = clean_text if isinstance(clean_text, str) else ""
+            print(f"\nOriginal text (first 200 chars):")
+            print(f"{orig_text[:200]}..." if len(orig_text) > 200 else orig_text)
+            print(f"\nCleaned text (first 200 chars):")
+            print(f"{clean_text[:200]}..." if len(clean_text) > 200 else clean_text)
+            print(f"\nCharacter count: {audit['before'].iloc[row]} → {audit['after'].iloc[row]} "
+                  f"({audit['reduction'].iloc[row]:.1%} reduction)")
             print("-"*80)
-        
-        return True
+
+        print(f"Audit done in {time.perf_counter() - start:.1f}s")
+        return audit
     except Exception as e:
         print(f"Error analyzing cleaning differences: {e}")
-        return False
+        return None
 
 # Processed the dataset.
 if __name__ == "__main__":
+    if run_cleaning_benchmark:
+        benchmark_on_cached_data()
+    if run_rule_profile:
+        profile_on_cached_data()
+
     result = process_cleaned_dataset()
     
     if result is not None:
@@ -484,5 +1459,5 @@ if __name__ == "__main__":
         analyze_cleaning_differences()
         
         print("\n Extra cleaning done.")
-        print(f"The cleaned data is saved at: {output_file}")
-        print(f"A minimal version is saved at: {os.path.join(cache_dir, 'trafilatura_quality_minimal.pkl')}")
+        print(f"The cleaned data is saved at: {get_cache_path(output_file)}")
+        print(f"A minimal version is available as the 'minimal' view of {output_file}")
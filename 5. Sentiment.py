@@ -2,21 +2,51 @@
 # I input 1,000 samples in Chat GPT and got it's input for analyzing the sentiment of each article.
 
 import pandas as pd
+import pyarrow as pa
 from textblob import TextBlob
+from polarity_scoring import batch_polarity
+# The same segmentation as the cleaning scripts, which store the offsets next to trafilatura_text.
+from sentence_segmentation import sentence_offsets
 import os
-import glob
+import json
+import hashlib
+import argparse
+from datetime import datetime
+try:
+    import fcntl
+except ImportError:
+    # File locks are only available on Unix, elsewhere only one process should run on an output folder.
+    fcntl = None
 
-# Loaded data.
-df = pd.read_csv("/Users/casey/Documents/GitHub/NLP sentiment/part_10.csv")
+# Dataset used when no path is given on the command line.
+dataset_path = "/Users/casey/Documents/GitHub/NLP sentiment/part_10.csv"
 
 # Defined AI and workplace related terms.
 ai_terms = ["AI", "artificial intelligence", "machine learning", "automation", "algorithms"]
 job_terms = ["job loss", "job displacement", "productivity", "upskilling", "reskilling", "employment", "layoff", "hiring", "labor"]
 
-# Analyzed the sentiment of a text using textblob and m custom logic.
-def analyze_sentiment(text):
-    blob = TextBlob(text)
-    sentiment_score = blob.sentiment.polarity
+# Set to True to score the polarity of a shard with batch_polarity instead of TextBlob article by article. It is 4-18x
+# faster and gave the same polarity as TextBlob up to rounding (1e-15) on 8,000 articles and 80,000 fuzzed texts, see
+# polarity_scoring. It is a reimplementation, so check it with compare_polarity on the data before turning it on.
+use_batch_polarity = False
+
+# Sentence offsets of the batch. Data from the further cleaning has them stored next to trafilatura_text, a CSV
+# export has none or has them as text, then every article is segmented here once.
+def batch_sentence_offsets(batch):
+    if 'trafilatura_sentence_starts' in batch.columns and 'trafilatura_sentence_ends' in batch.columns:
+        stored = batch['trafilatura_sentence_starts'].dropna()
+        if len(stored) == len(batch) and (len(stored) == 0 or pd.api.types.is_list_like(stored.iloc[0])):
+            return list(zip(batch['trafilatura_sentence_starts'], batch['trafilatura_sentence_ends']))
+    return [sentence_offsets(text) if isinstance(text, str) else ([], []) for text in batch['trafilatura_text']]
+
+evidence_terms = ai_terms + job_terms
+
+# Analyzed the sentiment of a text using textblob and m custom logic. The polarity can be given from batch_polarity
+# and the sentence offsets from batch_sentence_offsets.
+def analyze_sentiment(text, sentiment_score=None, sentences=None):
+    if sentiment_score is None:
+        blob = TextBlob(text)
+        sentiment_score = blob.sentiment.polarity
 
     # Overall sentiment.
     if sentiment_score > 0.1:
@@ -37,10 +67,16 @@ def analyze_sentiment(text):
     else:
         workplace_sentiment = "Neutral"
 
-    # Extracted evidence sentences related to AI and job impact.
-    sentences = text.split(".")
-    evidence = [s.strip() for s in sentences if any(term in s.lower() for term in ai_terms + job_terms)]
-    evidence = evidence[:2]  
+    # Extracted evidence sentences related to AI and job impact, the terms are searched between the offsets of each
+    # sentence and the search stops at the second one. The offsets index the lowercased text too unless its length changed.
+    if sentences is None or len(lower_text) != len(text):
+        sentences = sentence_offsets(lower_text)
+    evidence = []
+    for start, end in zip(*sentences):
+        if any(lower_text.find(term, start, end) >= 0 for term in evidence_terms):
+            evidence.append(text[start:end])
+            if len(evidence) == 2:
+                break
 
     return {
         "overall_sentiment": overall_sentiment,
@@ -49,23 +85,195 @@ def analyze_sentiment(text):
         "contextual_notes": f"AI terms and job impact terms {'appear close together' if ai_near_job else 'do not co-occur significantly'}."
     }
 
-batch_size = 20000
-total_rows = len(df)
-
+# Resumable sharded runner.
+# The dataset is split in shards of shard_size rows and every shard is written to its own CSV file. A finished shard
+# is appended to the manifest with its row range and a checksum of its rows, and it is skipped on the next run as long
+# as its rows did not change. Several processes can run on the same dataset and output folder at once: a process
+# locks a shard before scoring it and the others move on to the next shard. The lock is released when the process
+# ends, also when it crashed, and every output is written to a file of its own process before it is renamed.
+shard_size = 20000
 output_folder = "sentiment_batches"
-os.makedirs(output_folder, exist_ok=True)
+manifest_name = "manifest.jsonl"
+# The sentence offsets are only used to find the evidence, they are not written to the CSV files.
+offset_columns = ['sentence_starts', 'sentence_ends', 'trafilatura_sentence_starts', 'trafilatura_sentence_ends']
+
+def load_dataset(path):
+    extension = os.path.splitext(path)[1].lower()
+    if extension == '.parquet':
+        return pd.read_parquet(path)
+    if extension in ('.arrow', '.feather', '.ipc'):
+        return pa.ipc.open_file(pa.memory_map(path)).read_all().to_pandas()
+    return pd.read_csv(path)
+
+def shard_checksum(shard):
+    hashes = pd.util.hash_pandas_object(shard.drop(columns=offset_columns, errors='ignore'), index=False)
+    return hashlib.blake2b(hashes.to_numpy().tobytes(), digest_size=16).hexdigest()
+
+# The last entry of every row range in the manifest.
+def read_manifest(folder):
+    entries = {}
+    path = os.path.join(folder, manifest_name)
+    if os.path.exists(path):
+        with open(path, encoding='utf-8') as f:
+            for line in f:
+                try:
+                    entry = json.loads(line)
+                except json.JSONDecodeError:
+                    # A line cut short by a crash while it was written.
+                    continue
+                entries[(entry['start'], entry['end'])] = entry
+    return entries
+
+# The output of the manifest entry of a shard, or None when the shard is not done. A shard is done when its rows and the
+# polarity scorer are the same, the first manifests were all written with the first batch polarity.
+def finished_output(folder, entry, checksum):
+    if (entry is not None and entry['checksum'] == checksum and entry.get('polarity', 'batch') == polarity_scorer()
+            and os.path.exists(os.path.join(folder, entry['output']))):
+        return entry['output']
+    return None
+
+def shard_done(folder, start, end, checksum):
+    return finished_output(folder, read_manifest(folder).get((start, end)), checksum) is not None
+
+def append_to_manifest(folder, entry):
+    with open(os.path.join(folder, manifest_name), 'a', encoding='utf-8') as f:
+        if fcntl is not None:
+            fcntl.flock(f, fcntl.LOCK_EX)
+        f.write(json.dumps(entry) + "\n")
+        f.flush()
+        os.fsync(f.fileno())
+
+# The open lock file of the shard, or None when another process has the shard.
+def lock_shard(folder, name):
+    handle = open(os.path.join(folder, name + ".lock"), 'a')
+    if fcntl is None:
+        return handle
+    try:
+        fcntl.flock(handle, fcntl.LOCK_EX | fcntl.LOCK_NB)
+    except BlockingIOError:
+        handle.close()
+        return None
+    return handle
 
-for start in range(0, total_rows, batch_size):
-    print(f"Processing rows {start} to {start+batch_size}...")
-    batch = df.iloc[start:start+batch_size].copy()
+# The batch polarity scores emoticons and "(!)" with TextBlob since batch-2, shards scored by the first one are redone.
+def polarity_scorer():
+    return 'batch-2' if use_batch_polarity else 'textblob'
 
-    batch["sentiment_analysis"] = batch["trafilatura_text"].apply(analyze_sentiment)
+def score_shard(batch):
+    if use_batch_polarity:
+        polarities = batch_polarity(batch["trafilatura_text"])
+    else:
+        # analyze_sentiment scores every article with TextBlob.
+        polarities = [None] * len(batch)
+    sentences = batch_sentence_offsets(batch)
+    batch["sentiment_analysis"] = [analyze_sentiment(text, polarity, offsets)
+                                   for text, polarity, offsets in zip(batch["trafilatura_text"], polarities, sentences)]
     batch["overall_sentiment"] = batch["sentiment_analysis"].apply(lambda x: x["overall_sentiment"])
     batch["workplace_sentiment"] = batch["sentiment_analysis"].apply(lambda x: x["workplace_sentiment"])
     batch["evidence"] = batch["sentiment_analysis"].apply(lambda x: x["evidence"])
     batch["contextual_notes"] = batch["sentiment_analysis"].apply(lambda x: x["contextual_notes"])
-    batch.drop(columns=["sentiment_analysis"], inplace=True)
+    batch.drop(columns=["sentiment_analysis"] + offset_columns, inplace=True, errors='ignore')
+    return batch
+
+# Row range and checksum of every shard of the dataset.
+def shard_layout(df, size=shard_size):
+    return [(start, min(start + size, len(df)), shard_checksum(df.iloc[start:start + size]))
+            for start in range(0, len(df), size)]
+
+def run_sentiment_shards(path, folder=output_folder, size=shard_size):
+    df = load_dataset(path)
+    os.makedirs(folder, exist_ok=True)
+
+    written = 0
+    finished = 0
+    elsewhere = 0
+    for start, end, checksum in shard_layout(df, size):
+        name = f"sentiment_{start:09d}_{end:09d}"
+        if shard_done(folder, start, end, checksum):
+            finished += 1
+            continue
+
+        lock = lock_shard(folder, name)
+        if lock is None:
+            print(f"Rows {start} to {end} are processed by another process.")
+            elsewhere += 1
+            continue
+        try:
+            # Checked again, another process could have finished the shard before it was locked here.
+            if shard_done(folder, start, end, checksum):
+                finished += 1
+                continue
+
+            print(f"Processing rows {start} to {end}...")
+            output = name + ".csv"
+            partial_path = os.path.join(folder, f"{output}.{os.getpid()}.part")
+            score_shard(df.iloc[start:end].copy()).to_csv(partial_path, index=False)
+            os.replace(partial_path, os.path.join(folder, output))
+            append_to_manifest(folder, {
+                'start': start,
+                'end': end,
+                'checksum': checksum,
+                'output': output,
+                'polarity': polarity_scorer(),
+                'dataset': os.path.abspath(path),
+                'finished_at': datetime.now().isoformat(timespec='seconds'),
+            })
+            written += 1
+        finally:
+            lock.close()
+
+    print(f"Data saved: {written} shards written, {finished} already finished, {elsewhere} left to other processes.")
+    return written, finished, elsewhere
+
+# Labels as scores for the average, the same mapping as the EDA notebook.
+sentiment_map = {'Negative': -1, 'Neutral': 0, 'Positive': 1}
+
+# Weighted counts and average sentiment of the finished shards of the dataset. The near-duplicate removal keeps one row
+# per syndicated story and the number of copies in cluster_size, so every row counts as that many articles. Data
+# without the column counts every row once.
+# The folder can hold the outputs of runs with another shard size or of other datasets, those would count articles
+# twice or count articles that are not in the dataset. Only the outputs of the shards of the dataset as it is split now
+# are read, with the same rows and polarity scorer as when they were written.
+def summarize_sentiment(path, folder=output_folder, size=shard_size):
+    layout = shard_layout(load_dataset(path), size)
+    entries = read_manifest(folder)
+    outputs = [finished_output(folder, entries.get((start, end)), checksum) for start, end, checksum in layout]
+    missing = sum(output is None for output in outputs)
+    outputs = [output for output in outputs if output is not None]
+    if missing:
+        print(f"{missing} of {len(layout)} shards are not finished, they are left out of the summary.")
+    if not outputs:
+        print("No finished shards to summarize.")
+        return None
+
+    wanted = {'overall_sentiment', 'workplace_sentiment', 'cluster_size'}
+    df = pd.concat([pd.read_csv(os.path.join(folder, output), usecols=lambda column: column in wanted)
+                    for output in outputs], ignore_index=True)
+    if 'cluster_size' in df.columns:
+        weights = df['cluster_size'].fillna(1)
+    else:
+        weights = pd.Series(1, index=df.index)
 
-    batch.to_csv(f"{output_folder}/sentiment_analysis_batch_10.csv", index=False)
+    summary = {}
+    for column in ['overall_sentiment', 'workplace_sentiment']:
+        counts = weights.groupby(df[column]).sum()
+        scores = df[column].map(sentiment_map)
+        scored = scores.notna()
+        average = (scores[scored] * weights[scored]).sum() / max(weights[scored].sum(), 1)
+        summary[column] = {'counts': counts.to_dict(), 'average': average}
+        shares = ", ".join(f"{label}: {count:,.0f} ({count / max(counts.sum(), 1):.1%})" for label, count in counts.items())
+        print(f"{column} of {weights.sum():,.0f} articles in {len(df)} rows - {shares}, average {average:+.3f}")
+    return summary
 
-print("Data saved.")
+if __name__ == "__main__":
+    parser = argparse.ArgumentParser(description="Sentiment of the articles, written to one CSV file per shard of rows.")
+    parser.add_argument('dataset', nargs='?', default=dataset_path,
+                        help="CSV, Parquet or Arrow file with a trafilatura_text column")
+    parser.add_argument('--shard-size', type=int, default=shard_size)
+    parser.add_argument('--output-folder', default=output_folder)
+    parser.add_argument('--batch-polarity', action='store_true', default=use_batch_polarity,
+                        help="score the polarity with batch_polarity, faster than TextBlob, check it with compare_polarity first")
+    args = parser.parse_args()
+    use_batch_polarity = args.batch_polarity
+    run_sentiment_shards(args.dataset, args.output_folder, args.shard_size)
+    summarize_sentiment(args.dataset, args.output_folder, args.shard_size)
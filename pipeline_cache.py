@@ -0,0 +1,286 @@
+# Cache and deduplication helpers shared by the cleaning scripts and the notebooks.
+# I stored the DataFrames in the cache as uncompressed Arrow IPC files instead of pickles. The file is memory mapped
+# when loaded, so a stage that needs a few columns only reads those instead of deserializing the whole dataset.
+# Column subsets that used to be saved as separate copies are kept as named views in the file metadata. Other objects,
+# such as the topic model, are still pickled.
+
+import os
+import re
+import glob
+import json
+import time
+import pickle
+import shutil
+import hashlib
+import inspect
+import numpy as np
+import pandas as pd
+import pyarrow as pa
+
+cache_dir = "cache"
+
+# Per-article cleaning cache of the cleaning scripts, one directory per cleaner version.
+cleaning_cache_dir = os.path.join(cache_dir, "cleaning_cache")
+# Versions kept per cleaner, older ones are deleted after each run.
+cleaning_cache_versions_kept = 2
+# A version with more files than this is merged into one file when a run starts.
+cleaning_cache_max_parts = 64
+
+def get_cache_path(filename):
+    return os.path.join(cache_dir, filename)
+
+def columnar_cache_path(filename):
+    return os.path.splitext(get_cache_path(filename))[0] + ".arrow"
+
+def pickle_cache_path(filename):
+    return os.path.splitext(get_cache_path(filename))[0] + ".pkl"
+
+# Columns holding dicts would come back from Arrow with the missing keys filled in, so those DataFrames are still pickled.
+def can_store_columnar(obj):
+    if not isinstance(obj, pd.DataFrame):
+        return False
+    for column in obj.columns[obj.dtypes == object]:
+        values = obj[column].dropna()
+        if len(values) > 0 and isinstance(values.iloc[0], dict):
+            return False
+    return True
+
+def add_cache_views(schema, views):
+    metadata = dict(schema.metadata or {})
+    metadata[b'cache_views'] = json.dumps(views or {}).encode()
+    return schema.with_metadata(metadata)
+
+# The Arrow table of a DataFrame, or None when a column has no Arrow type. can_store_columnar only looks at the first
+# value of a column, a column that mixes strings and numbers or holds dicts further down only fails here.
+def columnar_table(obj, filename):
+    if not can_store_columnar(obj):
+        return None
+    try:
+        return pa.Table.from_pandas(obj)
+    except (pa.ArrowInvalid, pa.ArrowTypeError, pa.ArrowNotImplementedError) as e:
+        print(f"{filename} has a column Arrow cannot store ({e}), pickling it instead")
+        return None
+
+def save_to_cache(obj, filename, views=None):
+    table = columnar_table(obj, filename)
+    if table is not None:
+        table = table.replace_schema_metadata(add_cache_views(table.schema, views).metadata)
+        path = columnar_cache_path(filename)
+        with pa.OSFile(path + ".part", 'wb') as sink, pa.ipc.new_file(sink, table.schema) as writer:
+            writer.write_table(table)
+        os.replace(path + ".part", path)
+    else:
+        with open(pickle_cache_path(filename), 'wb') as f:
+            pickle.dump(obj, f)
+        # load_from_cache reads the Arrow file first, an older one would hide the pickle.
+        if os.path.exists(columnar_cache_path(filename)):
+            os.remove(columnar_cache_path(filename))
+    print(f"Saved {filename} to cache")
+
+def get_cache_views(filename):
+    path = columnar_cache_path(filename)
+    if not os.path.exists(path):
+        return {}
+    schema = pa.ipc.open_file(pa.memory_map(path)).schema
+    return json.loads((schema.metadata or {}).get(b'cache_views', b'{}'))
+
+# Column names of a cached DataFrame, read from the schema without loading any rows. Empty for a pickle.
+def get_cache_columns(filename):
+    path = columnar_cache_path(filename)
+    if not os.path.exists(path):
+        return []
+    return pa.ipc.open_file(pa.memory_map(path)).schema.names
+
+# Loaded a DataFrame from the cache, only the requested columns (or the columns of a view) are read.
+# Pickles from earlier runs are still loaded when there is no Arrow file.
+def load_from_cache(filename, columns=None, view=None):
+    path = columnar_cache_path(filename)
+    if os.path.exists(path):
+        table = pa.ipc.open_file(pa.memory_map(path)).read_all()
+        if view is not None:
+            columns = json.loads(table.schema.metadata[b'cache_views'])[view]
+        if columns is not None:
+            # Keeping the stored index columns so the rows keep their original index.
+            pandas_metadata = table.schema.pandas_metadata or {}
+            index_columns = [column for column in pandas_metadata.get('index_columns', []) if isinstance(column, str)]
+            table = table.select(list(columns) + index_columns)
+        return table.to_pandas()
+
+    path = pickle_cache_path(filename)
+    if os.path.exists(path):
+        with open(path, 'rb') as f:
+            obj = pickle.load(f)
+        if view is not None:
+            print(f"{filename} is a pickle and has no views, loading all columns")
+        elif columns is not None:
+            obj = obj[list(columns)]
+        return obj
+    return None
+
+# I cached the cleaning result of every article under a hash of its raw text, one directory per cleaner version.
+# The version is a hash of the code and rules the cleaner uses, so changing a rule only cleans the articles again for
+# that cleaner, and a re-run with the same rules only cleans the articles that are new.
+# Reading the whole cache and writing it back on every call made a streamed dataset quadratic, since every batch is a
+# call. The key index of a version is now built once per run and kept in cleaning_cache_indexes, and every call that
+# cleans new articles writes them to a file of its own next to the others. The files are memory mapped, so only the
+# sorted keys of the index are held in memory.
+def text_hash(text):
+    return hashlib.blake2b(text.encode('utf-8', 'surrogatepass'), digest_size=16).hexdigest()
+
+def cleaner_version(*parts):
+    digest = hashlib.blake2b(digest_size=8)
+    for part in parts:
+        if inspect.isfunction(part):
+            part = inspect.getsource(part)
+        elif isinstance(part, re.Pattern):
+            part = (part.pattern, part.flags)
+        elif isinstance(part, (set, frozenset)):
+            part = sorted(part)
+        digest.update(repr(part).encode('utf-8'))
+    return digest.hexdigest()
+
+def cleaning_cache_path(name, version):
+    return os.path.join(cleaning_cache_dir, f"{name}-{version}")
+
+# Index of every version used in this run: the memory mapped files, and the sorted keys of every file with the row
+# each sorted key is at.
+cleaning_cache_indexes = {}
+
+def add_cleaning_cache_part(index, path):
+    table = pa.ipc.open_file(pa.memory_map(path)).read_all()
+    keys = np.array(table.column('key').to_numpy(zero_copy_only=False), dtype='S32')
+    order = np.argsort(keys, kind='stable')
+    index['tables'].append(table)
+    index['keys'].append(keys[order])
+    index['rows'].append(order)
+
+# Merged the files of a version into one when there are too many, every key is kept once.
+def merge_cleaning_cache_parts(path, files):
+    tables = [pa.ipc.open_file(pa.memory_map(file)).read_all() for file in files]
+    merged = pa.concat_tables(tables, promote_options='permissive')
+    _, first = np.unique(np.array(merged.column('key').to_numpy(zero_copy_only=False), dtype='S32'), return_index=True)
+    merged = merged.take(np.sort(first))
+    del tables
+    merged_file = write_cleaning_cache_part(path, merged)
+    for file in files:
+        os.remove(file)
+    print(f"Merged {len(files)} cleaning cache files of {os.path.basename(path)}")
+    return merged_file
+
+def write_cleaning_cache_part(path, table):
+    file = os.path.join(path, f"part-{time.time_ns()}-{os.getpid()}.arrow")
+    with pa.OSFile(file + ".part", 'wb') as sink, pa.ipc.new_file(sink, table.schema) as writer:
+        writer.write_table(table)
+    os.replace(file + ".part", file)
+    return file
+
+def load_cleaning_cache_index(name, version):
+    path = cleaning_cache_path(name, version)
+    if path in cleaning_cache_indexes:
+        return cleaning_cache_indexes[path]
+
+    os.makedirs(path, exist_ok=True)
+    # A cache written as a single file by an earlier version of this function becomes the first file of the directory.
+    if os.path.exists(path + ".arrow"):
+        os.replace(path + ".arrow", os.path.join(path, "part-0-0.arrow"))
+    files = sorted(glob.glob(os.path.join(path, "part-*.arrow")))
+    if len(files) > cleaning_cache_max_parts:
+        files = [merge_cleaning_cache_parts(path, files)]
+
+    index = {'path': path, 'tables': [], 'keys': [], 'rows': []}
+    for file in files:
+        add_cleaning_cache_part(index, file)
+    cleaning_cache_indexes[path] = index
+    return index
+
+# File and row of every key in the index, -1 as the file of the keys that are not cached.
+def find_cached_rows(index, keys):
+    parts = np.full(len(keys), -1, dtype=np.int64)
+    rows = np.zeros(len(keys), dtype=np.int64)
+    for part, (sorted_keys, sorted_rows) in enumerate(zip(index['keys'], index['rows'])):
+        if len(sorted_keys) == 0:
+            continue
+        positions = np.minimum(np.searchsorted(sorted_keys, keys), len(sorted_keys) - 1)
+        found = (parts < 0) & (sorted_keys[positions] == keys)
+        parts[found] = part
+        rows[found] = sorted_rows[positions[found]]
+    return parts, rows
+
+# Deleted the oldest versions of a cleaner's cache, a version is refreshed every time it is used.
+def evict_stale_cleaning_cache(name):
+    paths = sorted(glob.glob(os.path.join(cleaning_cache_dir, f"{name}-*")), key=os.path.getmtime, reverse=True)
+    for path in paths[cleaning_cache_versions_kept:]:
+        if os.path.isdir(path):
+            shutil.rmtree(path)
+        else:
+            os.remove(path)
+        cleaning_cache_indexes.pop(path, None)
+        print(f"Removed stale cleaning cache {os.path.basename(path)}")
+
+# Returned the cleaned columns for the texts, running clean_texts only on the texts not cached for this version.
+# clean_texts takes a list of texts and returns one list per column. excluded_keys, when given, is called after the
+# cleaning and returns the keys whose result must not be stored.
+def cached_clean(texts, name, version, clean_texts, columns, excluded_keys=None):
+    texts = list(texts)
+    keys = [text_hash(text) if isinstance(text, str) else None for text in texts]
+    index = load_cleaning_cache_index(name, version)
+    os.utime(index['path'])
+
+    # Missing texts have no key and are never found.
+    parts, rows = find_cached_rows(index, np.array([key or '' for key in keys], dtype='S32'))
+    results = [[None] * len(texts) for _ in columns]
+    hits = 0
+    for part in np.unique(parts[parts >= 0]).tolist():
+        positions = np.flatnonzero(parts == part)
+        stored = index['tables'][part].take(rows[positions])
+        hits += len(positions)
+        for values, column in zip(results, columns):
+            for position, value in zip(positions.tolist(), stored.column(column).to_pylist()):
+                values[position] = value
+
+    missing = np.flatnonzero(parts < 0).tolist()
+    if missing:
+        cleaned = clean_texts([texts[position] for position in missing])
+        for values, column_values in zip(results, cleaned):
+            for position, value in zip(missing, column_values):
+                values[position] = value
+
+        # Stored the new results in a new file, an article that appears twice is only stored once.
+        excluded = excluded_keys() if excluded_keys is not None else set()
+        new_rows = {}
+        for position in missing:
+            if keys[position] is not None and keys[position] not in new_rows and keys[position] not in excluded:
+                new_rows[keys[position]] = position
+        if new_rows:
+            new_table = pa.table({'key': list(new_rows),
+                                  **{column: [values[position] for position in new_rows.values()]
+                                     for column, values in zip(columns, results)}})
+            add_cleaning_cache_part(index, write_cleaning_cache_part(index['path'], new_table))
+
+    evict_stale_cleaning_cache(name)
+    hit_rate = hits / len(texts) if texts else 0
+    print(f"Cleaning cache {name}-{version}: {hits} hits, {len(missing)} misses ({hit_rate:.1%} reused)")
+    return results
+
+# Syndicated and wire stories appear many times in the corpus, so the cleaning scripts clean every distinct value once
+# and copy the result back to the rows that have it. Missing values are kept as one of the distinct values.
+def factorize_column(values):
+    codes, uniques = pd.factorize(pd.Series(values), use_na_sentinel=False)
+    return codes, list(uniques)
+
+def broadcast_unique(results, codes):
+    return pd.Series(results).to_numpy()[codes]
+
+# The time saved is estimated from the average time per distinct value.
+def report_dedup(label, n_rows, n_unique, elapsed):
+    duplicates = n_rows - n_unique
+    saved = elapsed / n_unique * duplicates if n_unique else 0.0
+    print(f"{label}: {n_unique} distinct values in {n_rows} rows ({duplicates / max(n_rows, 1):.1%} duplicates), "
+          f"about {saved:.1f}s saved")
+
+def apply_unique(values, func, label):
+    start = time.perf_counter()
+    codes, uniques = factorize_column(values)
+    results = [func(value) for value in uniques]
+    report_dedup(label, len(codes), len(uniques), time.perf_counter() - start)
+    return broadcast_unique(results, codes)
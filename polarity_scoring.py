@@ -0,0 +1,222 @@
+# Batch polarity scoring shared by the feature notebook and the sentiment script.
+# TextBlob(text).sentiment.polarity tokenizes every article and walks the pattern lexicon word by word in Python. I
+# loaded the same lexicon once into arrays, tokenized a whole batch with Arrow and applied its rules to all the known
+# words of the batch at once: an adverb modifies the next known word, a negation reverses it and exclamation marks
+# boost it.
+# It is a reimplementation of TextBlob, not a copy. The texts that may hold an emoticon or "(!)" are scored with TextBlob
+# itself, about 18% of long articles. On 8,000 articles, short texts and fuzzed texts and on 80,000 sentences fuzzed
+# with punctuation, emoticons and contractions every polarity was the same as TextBlob's up to rounding (1e-15).
+# Tokenizer corner cases outside these tests can still differ, compare_polarity measures it on the data.
+
+import re
+import time
+import numpy as np
+import pyarrow as pa
+import pyarrow.compute as pc
+from textblob import TextBlob
+from textblob.en import sentiment as pattern_lexicon
+from textblob._text import EMOTICONS
+
+polarity_negations = ['no', 'not', 'never']
+polarity_leading_punctuation = ",;:!?()[]{}`'\"@#$^&*+-|=~_"
+polarity_trailing_punctuation = polarity_leading_punctuation + "."
+# Quotes split words in TextBlob and are never words themselves, "n't" is split from the word before it. The other
+# whitespace of Python's \s is turned into spaces for the ASCII split.
+polarity_separators = r"(n)'(t)|['‘’“”\"\x1c-\x1f\x{85}\x{a0}\x{1680}\x{2000}-\x{200a}\x{2028}\x{2029}\x{202f}\x{205f}\x{3000}]"
+polarity_lexicon = {}
+
+# TextBlob joins the characters of an emoticon back together after its tokenizer split them apart, also when the text
+# had spaces between them ("note: (a)" scores as ":("), and "(!)" is an assessment of its own. The texts where one of
+# them may be found are scored with TextBlob itself. The pattern allows any whitespace between the characters, so it
+# finds every text TextBlob could find one in and a few more. A letter or digit at the start or end of an emoticon
+# has to be at the edge of a word, otherwise the tokenizer keeps it in the word ("Example: Decorators" has no ":D").
+# The tokenizer splits "n't" from the letters before it and "_" from the end of a word, so those are edges too
+# ("only: bn'te" has ":b", ":s__" has ":s"). The pattern is matched ignoring case.
+def emoticon_pattern(emoticon):
+    pattern = r'\s*'.join(re.escape(char) for char in emoticon)
+    if emoticon[0].isalnum():
+        pattern = r'(?:^|[^a-z0-9])' + pattern
+    if emoticon[-1].isalnum():
+        pattern += r"(?:[^a-z0-9]|$|n')"
+    return pattern
+
+polarity_fallback_pattern = '|'.join(
+    [emoticon_pattern(emoticon) for emoticons in EMOTICONS.values() for emoticon in emoticons] + [r'\(\s*!\s*\)'])
+
+def load_polarity_lexicon():
+    if not dict.__len__(pattern_lexicon):
+        pattern_lexicon.load()
+    words = sorted(dict.keys(pattern_lexicon))
+    entries = [dict.__getitem__(pattern_lexicon, word) for word in words]
+    scores = np.array([entry[None] for entry in entries], dtype=np.float64)
+    polarity_lexicon.update({
+        'words': pa.array(words),
+        'polarity': scores[:, 0],
+        'intensity': scores[:, 2],
+        'modifier': np.array(['RB' in entry for entry in entries]),
+        'adverb': np.array([word.endswith('ly') for word in words]),
+    })
+    return polarity_lexicon
+
+# Number of set values before each index, with one more value for the end.
+def prefix_counts(mask):
+    counts = np.zeros(len(mask) + 1, dtype=np.int32)
+    np.cumsum(mask, out=counts[1:])
+    return counts
+
+# Number, or sum of the values, of the sorted positions in [starts, ends).
+def range_sums(positions, starts, ends, values=None):
+    if values is None:
+        return np.searchsorted(positions, ends) - np.searchsorted(positions, starts)
+    sums = np.concatenate([[0], np.cumsum(values)])
+    return sums[np.searchsorted(positions, ends)] - sums[np.searchsorted(positions, starts)]
+
+# Polarity of every text, as TextBlob(text).sentiment.polarity gives it. The texts that may hold an emoticon or "(!)"
+# are scored by TextBlob, the others with the lexicon in array operations.
+def batch_polarity(texts):
+    texts = pc.fill_null(pa.array(texts, type=pa.large_string(), from_pandas=True), '')
+    polarities = lexicon_polarity(texts)
+    fallback = np.flatnonzero(pc.match_substring_regex(texts, polarity_fallback_pattern, ignore_case=True)
+                              .to_numpy(zero_copy_only=False))
+    for position, text in zip(fallback.tolist(), texts.take(pa.array(fallback)).to_pylist()):
+        polarities[position] = TextBlob(text).sentiment.polarity
+    return polarities
+
+def lexicon_polarity(texts):
+    lexicon = polarity_lexicon or load_polarity_lexicon()
+    polarities = np.zeros(len(texts))
+
+    # The lexicon is ASCII, so ASCII lowercase finds the same words.
+    split = pc.ascii_split_whitespace(pc.ascii_lower(pc.replace_substring_regex(texts, polarity_separators,
+                                                                                r' \1 \2')))
+    offsets = split.offsets.to_numpy().astype(np.int64)
+    if offsets[-1] == 0:
+        return polarities
+
+    # Every distinct token is looked at once: punctuation split from its start and end, then looked up in the lexicon.
+    encoded = pc.dictionary_encode(split.flatten())
+    token_ids = encoded.indices.to_numpy()
+    tokens = encoded.dictionary
+    trimmed = pc.utf8_ltrim(tokens, polarity_leading_punctuation)
+    words = pc.utf8_rtrim(trimmed, polarity_trailing_punctuation)
+    word_ids = pc.fill_null(pc.index_in(words, value_set=lexicon['words']), -1).to_numpy()
+    # TextBlob keeps the period of a single letter abbreviation ("a.") as part of the word.
+    lengths = pc.utf8_length(words).to_numpy()
+    lengths = lengths + ((lengths == 1) &
+                         pc.match_substring_regex(trimmed, r'^[a-z]\.\.?[^.]*$').to_numpy(zero_copy_only=False))
+    negation = pc.is_in(words, value_set=pa.array(polarity_negations)).to_numpy(zero_copy_only=False)
+    trimmed_bangs = pc.count_substring(trimmed, '!').to_numpy()
+    leading_bangs = pc.count_substring(tokens, '!').to_numpy() - trimmed_bangs
+    trailing_bangs = trimmed_bangs - pc.count_substring(words, '!').to_numpy()
+    ellipsis = pc.count_substring(tokens, '...').to_numpy() > pc.count_substring(words, '...').to_numpy()
+
+    word_ids = word_ids[token_ids]
+    unknown = word_ids < 0
+    lengths = lengths[token_ids]
+    negation = negation[token_ids]
+    # Exclamation marks and ellipses split from the words are rare, I kept their positions only.
+    bangs = np.flatnonzero((leading_bangs > 0) | (trailing_bangs > 0))
+    bangs = np.flatnonzero(np.isin(token_ids, bangs))
+    leading_bangs = leading_bangs[token_ids[bangs]]
+    trailing_bangs = trailing_bangs[token_ids[bangs]]
+    ellipses = np.flatnonzero(np.isin(token_ids, np.flatnonzero(ellipsis)))
+
+    # Unknown words that end a modifier or a negation before the next known word. The ellipsis split from the end of
+    # a word counts as one more long word after it.
+    modifier_breaks = prefix_counts(unknown & (lengths > 2))
+    adverb_breaks = prefix_counts(unknown & (lengths > 2) & ~negation)
+    negation_breaks = prefix_counts(unknown & (lengths > 1) & ~negation)
+    negations = np.flatnonzero(negation)
+
+    positions = np.flatnonzero(~unknown)
+    if len(positions) == 0:
+        return polarities
+    ids = word_ids[positions]
+    docs = np.searchsorted(offsets, positions, side='right') - 1
+    first_in_doc = np.concatenate([[True], docs[1:] != docs[:-1]])
+    last_in_doc = np.concatenate([docs[1:] != docs[:-1], [True]])
+    previous = np.where(first_in_doc, offsets[docs] - 1, np.concatenate([[0], positions[:-1]]))
+    after_previous = previous + 1
+    next_known = np.where(last_in_doc, offsets[docs + 1], np.concatenate([positions[1:], [0]]))
+    adverb = lexicon['modifier'][ids] & lexicon['adverb'][ids]
+    previous_modifier = np.concatenate([[False], lexicon['modifier'][ids[:-1]]]) & ~first_in_doc
+    previous_adverb = np.concatenate([[False], adverb[:-1]]) & ~first_in_doc
+
+    # A known word after a modifier, with only short words in between, is merged into the assessment of the modifier.
+    # After an "-ly" adverb a negation does not end the modifier.
+    gap = np.where(previous_adverb, adverb_breaks[positions] - adverb_breaks[after_previous],
+                   modifier_breaks[positions] - modifier_breaks[after_previous])
+    gap += range_sums(ellipses, previous, positions)
+    merged = previous_modifier & (gap == 0)
+
+    # A negation after an "-ly" adverb that still modifies goes to the assessment of the adverb.
+    if len(negations):
+        following = np.searchsorted(negations, positions)
+        first_negation = negations[np.minimum(following, len(negations) - 1)]
+        last_negation = negations[np.maximum(following - 1, 0)]
+    else:
+        first_negation = last_negation = positions
+    has_negation_after = (first_negation > positions) & (first_negation < next_known)
+    first_negation = np.where(has_negation_after, first_negation, positions)
+    adverb_negated = adverb & has_negation_after & \
+        (adverb_breaks[first_negation] - adverb_breaks[positions + 1] == 0) & \
+        (range_sums(ellipses, positions, first_negation) == 0)
+
+    # Otherwise the last negation before a known word negates it if only short words follow the negation.
+    has_negation_before = (last_negation < positions) & (last_negation > previous)
+    last_negation = np.where(has_negation_before, last_negation, positions)
+    taken_by_adverb = previous_adverb & (adverb_breaks[last_negation] - adverb_breaks[after_previous] == 0) & \
+        (range_sums(ellipses, previous, last_negation) == 0)
+    negated = has_negation_before & ~taken_by_adverb & \
+        (negation_breaks[positions] - negation_breaks[last_negation + 1] == 0) & \
+        (range_sums(ellipses, last_negation, positions) == 0)
+
+    # A known word that is not merged starts an assessment. The last word of the assessment gives its polarity,
+    # multiplied by the intensity of the word before it, inverted if that word was negated. The exclamation marks
+    # before the next known word boost it and a negation reverses it at half strength.
+    starts = np.flatnonzero(~merged)
+    sizes = np.diff(np.concatenate([starts, [len(ids)]]))
+    last = starts + sizes - 1
+    intensity = lexicon['intensity'][ids]
+    intensity = np.where(negated, 1.0 / intensity, intensity)
+    polarity = lexicon['polarity'][ids[last]]
+    polarity = np.where(sizes > 1, np.clip(polarity * intensity[np.maximum(last - 1, 0)], -1.0, 1.0), polarity)
+    ends = next_known[last]
+    exclamations = range_sums(bangs, positions[last], ends, trailing_bangs) + \
+        range_sums(bangs, positions[last] + 1, np.where(last_in_doc[last], ends, ends + 1), leading_bangs)
+    polarity = np.clip(polarity * 1.25 ** exclamations, -1.0, 1.0)
+    polarity = np.where(np.logical_or.reduceat(negated | adverb_negated, starts), polarity * -0.5, polarity)
+
+    counts = np.bincount(docs[starts], minlength=len(texts))
+    sums = np.bincount(docs[starts], weights=polarity, minlength=len(texts))
+    np.divide(sums, counts, out=polarities, where=counts > 0)
+    return polarities
+
+# 1 for positive, -1 for negative and 0 for neutral, as overall_sentiment in the sentiment script.
+def polarity_labels(polarities, cut_off=0.1):
+    return (polarities > cut_off).astype(np.int8) - (polarities < -cut_off).astype(np.int8)
+
+# Compared the batch polarity with TextBlob on a sample of the articles and timed both. Besides the size of the
+# differences it counts the articles whose label changes, with a text labelled positive above cut_off and negative
+# below -cut_off as in the sentiment script.
+def compare_polarity(texts, sample_size=2000, cut_off=0.1):
+    texts = [text for text in texts if isinstance(text, str)][:sample_size]
+
+    start = time.perf_counter()
+    reference = np.array([TextBlob(text).sentiment.polarity for text in texts])
+    textblob_time = time.perf_counter() - start
+
+    start = time.perf_counter()
+    polarities = batch_polarity(texts)
+    batch_time = time.perf_counter() - start
+
+    differences = np.abs(reference - polarities)
+    flipped = polarity_labels(reference, cut_off) != polarity_labels(polarities, cut_off)
+    n = max(len(texts), 1)
+    print(f"Polarity of {len(texts)} articles: TextBlob {textblob_time / n * 1e6:.0f} us per article, "
+          f"batch {batch_time / n * 1e6:.0f} us per article ({textblob_time / max(batch_time, 1e-9):.1f}x)")
+    if len(texts):
+        print(f"{(differences < 1e-9).mean():.1%} identical, {(differences <= 0.01).mean():.1%} within 0.01, "
+              f"p99 difference {np.quantile(differences, 0.99):.3f}, largest difference {differences.max():.3f}")
+        print(f"Label at +/-{cut_off} changed for {int(flipped.sum())} articles ({flipped.mean():.2%})")
+    return differences, flipped
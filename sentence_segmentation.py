@@ -0,0 +1,58 @@
+# Sentence segmentation shared by the cleaning scripts, the feature notebook and the sentiment script.
+# Splitting on '.' cut "U.S." and "3.5" in pieces, and every stage split the article again. The cleaned article is now
+# segmented once and the start and end offsets of its sentences are stored next to it. The stored offsets are only
+# valid if every stage segments the same way, so they all use this module. A sentence ends at '.', '!' or '?'
+# followed by whitespace, or at a line break, closing quotes and brackets stay in the sentence. A period inside a
+# number has no whitespace after it, and the period of an abbreviation or an initial ("U.S.", "Dr.", "J.") only ends
+# the sentence at a line break.
+
+import re
+import pandas as pd
+import pyarrow as pa
+
+sentence_boundary_pattern = re.compile(r'([.!?\n][.!?]*[\'"’”)\]]*)(?:\s+|$|(?<=\n))')
+sentence_abbreviations = {
+    'mr', 'mrs', 'ms', 'dr', 'prof', 'sr', 'jr', 'st', 'mt', 'gen', 'gov', 'sen', 'rep', 'rev', 'lt', 'col', 'capt',
+    'inc', 'ltd', 'co', 'corp', 'bros', 'dept', 'univ', 'assn', 'vs', 'etc', 'approx', 'est', 'fig', 'vol',
+    'jan', 'feb', 'mar', 'apr', 'jun', 'jul', 'aug', 'sep', 'sept', 'oct', 'nov', 'dec',
+}
+initialism_pattern = re.compile(r'(?:[^\W\d_]\.)*[^\W\d_]')
+
+# Start and end offsets of the sentences of a text, the whitespace between two sentences is in neither of them.
+# Lowercasing keeps the offsets unless it changes the length of the text.
+def sentence_offsets(text):
+    starts = []
+    ends = []
+    start = len(text) - len(text.lstrip())
+    for match in sentence_boundary_pattern.finditer(text, start):
+        punctuation = match.group(1)
+        if punctuation[0] == '\n':
+            end = match.start()
+            while end > start and text[end - 1].isspace():
+                end -= 1
+        else:
+            end = match.end(1)
+            if punctuation[0] == '.' and '\n' not in match.group():
+                # The word before the period, without the quotes and brackets it opens with.
+                period = match.start()
+                word_start = text.rfind(' ', start, period) + 1 or start
+                if period - word_start < 12:
+                    word = text[word_start:period].lstrip('(["\'‘“').lower()
+                    if word in sentence_abbreviations or initialism_pattern.fullmatch(word):
+                        continue
+        if end > start:
+            starts.append(start)
+            ends.append(end)
+        start = match.end()
+    end = len(text.rstrip())
+    if end > start:
+        starts.append(start)
+        ends.append(end)
+    return starts, ends
+
+# The offsets are stored as two list<int32> columns next to the cleaned text. The rows of the column are int32 views
+# of one Arrow buffer, as load_from_cache returns them.
+def sentence_offset_column(offsets, index):
+    offsets = pa.array(list(offsets), type=pa.list_(pa.int32()))
+    return pd.Series(offsets.to_numpy(zero_copy_only=False), index=index)
+